@@ -1,5 +1,8 @@
 import dash_bootstrap_components
 from dash import Dash
+from flask import request
+
+from .utility import callback_pool
 
 index_string = '''
 <!DOCTYPE html>
@@ -28,6 +31,17 @@ def add_dash(server, debug):
                     dash_bootstrap_components.themes.BOOTSTRAP])
     dash_app.enable_dev_tools(debug=debug)
     dash_app.index_string = index_string
+    # Lets a browser's newer view updates supersede its older ones. Only Dash
+    # pages set the cookie, so API and file responses stay cacheable
+    page_endpoints = {
+        dash_app.config.routes_pathname_prefix + path for path in ["", "<path:path>"]
+    }
+
+    @server.after_request
+    def set_client_cookie(response):
+        if request.endpoint in page_endpoints:
+            return callback_pool.set_client_cookie(response)
+        return response
 
     # Set initial Dash page's layout
     from . import known_pages_router
@@ -18,6 +18,7 @@ pagenames = [
     # Turn on once GDI-2080 is resoved
     # "runscanner_illumina_flowcell",
     "sample_swaps",
+    "donor_identities",
     "single_lane_tar",
     "single_lane_rna",
     "single_lane_wgs",
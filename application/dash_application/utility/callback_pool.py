@@ -0,0 +1,458 @@
+"""
+Run CPU-heavy Dash callbacks in a pool of processes, so that the web worker
+only waits for the result and keeps serving other requests meanwhile.
+
+The pool processes are forked from the web worker the first time a callback is
+offloaded, so they share the view DataFrames that were already loaded and the
+callbacks registered by then. Set CALLBACK_PROCESSES to the number of pool
+processes per web worker. With the default of 0, callbacks run in the web
+worker that received the request.
+
+Either way, identical requests that arrive while a callback is already running
+for the same arguments and data version wait for that run and share its
+result, rather than repeating the work. Selections are compared regardless of
+their order.
+
+Each view runs at most CALLBACK_CONCURRENCY callbacks at once per web worker,
+with at most CALLBACK_QUEUE_LIMIT more requests waiting. A request that has not
+finished when the same browser tab sends a newer one to the same view is dropped.
+Views can estimate the cost of a request: above CALLBACK_HEAVY_COST, requests
+take turns in a single slot per view, and above CALLBACK_MAX_COST they are
+rejected. Views answer rejected requests with a message, e.g. in place of their
+graphs.
+"""
+import functools
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Collection, List, Optional, Tuple
+
+import flask
+from dash import dcc, no_update
+from dash.exceptions import PreventUpdate
+from pandas import DataFrame
+
+logger = logging.getLogger(__name__)
+
+pool_size = int(os.getenv("CALLBACK_PROCESSES", "0"))
+concurrency = int(os.getenv("CALLBACK_CONCURRENCY", str(max(pool_size, 1))))
+queue_limit = int(os.getenv("CALLBACK_QUEUE_LIMIT", "8"))
+heavy_cost = float(os.getenv("CALLBACK_HEAVY_COST", "inf"))
+max_cost = float(os.getenv("CALLBACK_MAX_COST", "inf"))
+
+# How often waiting requests check whether they were superseded, in seconds
+_poll_interval = 0.25
+
+# Offloaded callbacks by name. Pool processes are forked after the callbacks are
+# registered, so they look the functions up here instead of unpickling them
+_callbacks = {}
+
+_pool = None
+_pool_pid = None
+
+# Reentrant, as cancelling a future runs its done callbacks in the same thread
+_lock = threading.RLock()
+
+# Running callbacks by request key, shared by identical requests
+_in_flight = {}
+
+# Concurrency limits by callback name
+_admissions = {}
+
+# Cookie with a random id for each browser, and store with a random id for each
+# of its tabs, so a tab's newer requests can supersede its older ones without
+# cancelling those of other tabs
+client_cookie = "dashi_client"
+tab_store_id = "tab-id"
+
+# Offloaded callbacks get the data of the tab store as this argument
+tab_param = "tab_id"
+
+# Latest request by browser tab and callback name
+_session_requests = {}
+
+
+class CallbackRejected(Exception):
+    """A request was turned away because it is too large or the view is too busy"""
+
+
+class _Admission:
+    """Concurrency limits of one offloaded callback"""
+    def __init__(self):
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.heavy_slot = threading.BoundedSemaphore(1)
+        self.waiting = 0
+
+
+class _Request:
+    """A request, superseded once the same browser tab sends a newer one"""
+    def __init__(self, session: Optional[tuple] = None):
+        self.session = session
+        self.superseded = threading.Event()
+
+
+class _Run:
+    """
+    A running callback and the number of requests waiting for it. Runs in the
+    web worker have no pool.
+    """
+    def __init__(self, pool: Optional[ProcessPoolExecutor], future: Future):
+        self.pool = pool
+        self.future = future
+        self.waiters = 1
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """The pool of the current web worker, created on first use"""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ProcessPoolExecutor(
+            max_workers=pool_size,
+            mp_context=multiprocessing.get_context("fork")
+        )
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor):
+    """Drop a broken pool, so the next callback starts a fresh one"""
+    global _pool
+    with _lock:
+        # Other requests on the same pool may have replaced it already
+        if _pool is not broken:
+            return
+        _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit(name: str, args: tuple, kwargs: dict) -> Tuple[ProcessPoolExecutor, Future]:
+    """Submit a callback to the pool, starting a fresh pool if the current one broke"""
+    pool = _get_pool()
+    try:
+        return pool, pool.submit(_run_callback, name, args, kwargs)
+    except BrokenProcessPool:
+        # A pool process died after the last callback was collected
+        logger.error("Callback pool broke, starting a new one")
+        _reset_pool(pool)
+        pool = _get_pool()
+        return pool, pool.submit(_run_callback, name, args, kwargs)
+
+
+def _run_callback(name: str, args: tuple, kwargs: dict):
+    """Runs in a pool process"""
+    return _callbacks[name](*args, **kwargs)
+
+
+def _run_here(name: str, run: _Run, args: tuple, kwargs: dict):
+    """Run a callback in the web worker, leaving its result for the requests that joined it"""
+    run.future.set_running_or_notify_cancel()
+    try:
+        result = _callbacks[name](*args, **kwargs)
+    except BaseException as e:
+        run.future.set_exception(e)
+    else:
+        run.future.set_result(result)
+
+
+def _key_json(value) -> str:
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _request_key(name: str, dataversion: Callable, args: tuple, kwargs: dict,
+                 selections: Collection = ()) -> str:
+    """
+    Identifies requests that would compute the same result. Arguments whose
+    position or name is in `selections` filter rows (runs, projects, ...)
+    whatever their order, so they are sorted and the same selection made in a
+    different order gives the same key. Other arguments, such as the names to
+    show, keep their order.
+    """
+    def normalized(arg, selection: bool):
+        if selection and isinstance(arg, (list, tuple)):
+            return sorted(arg, key=_key_json)
+        return arg
+
+    return _key_json([
+        name,
+        dataversion() if dataversion else None,
+        [normalized(arg, i in selections) for i, arg in enumerate(args)],
+        {k: normalized(v, k in selections) for k, v in kwargs.items()},
+    ])
+
+
+def tab_store() -> dcc.Store:
+    """The tab store, with a new id. Added to each page as it is loaded"""
+    return dcc.Store(id=tab_store_id, data=uuid.uuid4().hex)
+
+
+def set_client_cookie(response: flask.Response) -> flask.Response:
+    """Give the browser a random id, if it has none yet"""
+    if client_cookie not in flask.request.cookies:
+        response.set_cookie(client_cookie, uuid.uuid4().hex, httponly=True, samesite="Lax")
+    return response
+
+
+def _new_request(name: str, tab: Optional[str]) -> _Request:
+    """Register a request, superseding the previous one of the same browser tab"""
+    client = None
+    if flask.has_request_context():
+        client = flask.request.cookies.get(client_cookie)
+    if client is None or tab is None:
+        # The tab can't be told apart from others, e.g. on the browser's first
+        # request, so nothing is superseded
+        return _Request()
+    session = (name, client, tab)
+    request = _Request(session)
+    with _lock:
+        previous = _session_requests.get(session)
+        _session_requests[session] = request
+    if previous is not None:
+        previous.superseded.set()
+    return request
+
+
+def _end_request(request: _Request):
+    """Forget a finished request, unless the browser has sent a newer one"""
+    if request.session is None:
+        return
+    with _lock:
+        if _session_requests.get(request.session) is request:
+            del _session_requests[request.session]
+
+
+def _acquire(name: str, slot: threading.BoundedSemaphore, request: _Request):
+    """Wait for a free slot, unless the queue is full or the request is superseded"""
+    admission = _admissions[name]
+    with _lock:
+        if admission.waiting >= queue_limit:
+            logger.warning("Rejected {0} request: {1} requests waiting".format(
+                name, admission.waiting))
+            raise CallbackRejected("Too many requests. Try again in a moment")
+        admission.waiting += 1
+    try:
+        while not slot.acquire(timeout=_poll_interval):
+            if request.superseded.is_set():
+                raise PreventUpdate
+    finally:
+        with _lock:
+            admission.waiting -= 1
+
+
+def _join(key: str) -> Optional[_Run]:
+    """The identical callback that is already running, if any"""
+    with _lock:
+        run = _in_flight.get(key)
+        if run is not None:
+            run.waiters += 1
+        return run
+
+
+def _start(name: str, key: str, args: tuple, kwargs: dict,
+           slots: List[threading.BoundedSemaphore]) -> _Run:
+    """
+    Start the callback, holding the slots until it is done. Without a pool, the
+    callback runs in the web worker and has finished when this returns.
+    """
+    with _lock:
+        run = _in_flight.get(key)
+        if run is not None:
+            # An identical request started while this one waited for its slots
+            run.waiters += 1
+            for slot in slots:
+                slot.release()
+            return run
+        if pool_size > 0:
+            run = _Run(*_submit(name, args, kwargs))
+        else:
+            run = _Run(None, Future())
+        _in_flight[key] = run
+
+    def finished(_):
+        with _lock:
+            if _in_flight.get(key) is run:
+                del _in_flight[key]
+        for slot in slots:
+            slot.release()
+
+    run.future.add_done_callback(finished)
+    if run.pool is None:
+        _run_here(name, run, args, kwargs)
+    return run
+
+
+def _wait(run: _Run, request: _Request):
+    """
+    Wait for the result. A superseded request stops waiting, and cancels the
+    callback if it has not started yet and no other request is waiting for it.
+    """
+    try:
+        while True:
+            try:
+                return run.future.result(timeout=_poll_interval)
+            except FutureTimeoutError:
+                if request.superseded.is_set():
+                    with _lock:
+                        if run.waiters == 1:
+                            run.future.cancel()
+                    raise PreventUpdate
+    finally:
+        with _lock:
+            run.waiters -= 1
+
+
+def row_count_cost(df: DataFrame, col: str, arg_index: int, graphs: int) -> Callable:
+    """
+    Cost estimate for `offload`: the number of rows of a view DataFrame that a
+    filter argument selects (all rows if nothing is selected), times the number
+    of graphs drawn.
+
+    Args:
+        df: The view DataFrame
+        col: The column the filter argument selects values of
+        arg_index: Position of the filter argument in the callback arguments
+        graphs: Number of graphs drawn for the selected rows
+    """
+    counts = df[col].value_counts()
+    total = len(df)
+
+    def cost(*args) -> float:
+        selected = args[arg_index]
+        if not selected:
+            return total * graphs
+        return counts.reindex(selected).fillna(0).sum() * graphs
+
+    return cost
+
+
+def message_figure(message: str) -> dict:
+    """An empty figure showing a message"""
+    return {
+        "data": [],
+        "layout": {
+            "xaxis": {"visible": False},
+            "yaxis": {"visible": False},
+            "annotations": [{
+                "text": message,
+                "xref": "paper",
+                "yref": "paper",
+                "showarrow": False,
+                "font": {"size": 18},
+            }],
+        },
+    }
+
+
+def rejected_figure(outputs: int, figure: int) -> Callable:
+    """
+    For `offload`: answer rejected requests with the reason in place of the
+    graphs, leaving the other outputs as they were.
+
+    Args:
+        outputs: Number of outputs of the callback
+        figure: Position of the figure output
+    """
+    def rejected(message: str) -> list:
+        result = [no_update] * outputs
+        result[figure] = message_figure(message)
+        return result
+
+    return rejected
+
+
+def offload(ignored_args: int = 0, dataversion: Callable = None,
+            cost: Callable = None, rejected: Callable = None,
+            selections: Collection[str] = ()) -> Callable:
+    """
+    Decorator for a Dash callback to run it in the callback pool. Place it below
+    the `dash_app.callback` decorator. Arguments and results must be picklable.
+
+    Args:
+        ignored_args: Number of leading arguments that don't affect the result,
+            such as button click counts. They are left out when matching
+            identical requests
+        dataversion: The view's `dataversion` function, so requests are only
+            matched against runs on the same data
+        cost: Estimates the cost of a request from the callback arguments,
+            e.g. `row_count_cost`
+        rejected: Builds the callback outputs from the message of a rejected
+            request, e.g. `rejected_figure`. Without it, the rejection is raised
+        selections: Names of the arguments that select rows, such as runs or
+            projects, whose order does not change the result
+
+    A callback with a `tab_id` argument, taking the data of the `tab_store_id`
+    store, supersedes the unfinished requests of the same browser tab. The tab
+    id is left out when matching identical requests.
+    """
+    def decorator(fn: Callable) -> Callable:
+        name = "{0}.{1}".format(fn.__module__, fn.__qualname__)
+        _callbacks[name] = fn
+        admission = _admissions[name] = _Admission()
+        params = list(inspect.signature(fn).parameters)
+        tab_position = params.index(tab_param) if tab_param in params else None
+        # Selection arguments by name and by position in the request key
+        key_params = [p for p in params[ignored_args:] if p != tab_param]
+        selection_keys = frozenset(selections) | frozenset(
+            key_params.index(s) for s in selections)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if tab_position is not None and tab_position < len(args):
+                tab = args[tab_position]
+                key_args = args[ignored_args:tab_position] + args[tab_position + 1:]
+            else:
+                tab = kwargs.get(tab_param)
+                key_args = args[ignored_args:]
+            key_kwargs = {k: v for k, v in kwargs.items() if k != tab_param}
+            request = _new_request(name, tab)
+            try:
+                request_cost = cost(*args) if cost is not None else 0
+                if request_cost > max_cost:
+                    logger.warning("Rejected {0} request with cost {1}".format(
+                        name, request_cost))
+                    raise CallbackRejected(
+                        "Too much data selected. Select fewer runs or projects")
+
+                key = _request_key(name, dataversion, key_args, key_kwargs, selection_keys)
+                run = _join(key)
+                if run is not None:
+                    logger.info("Joining running {0} for an identical request".format(name))
+                else:
+                    slots = []
+                    try:
+                        if request_cost > heavy_cost:
+                            _acquire(name, admission.heavy_slot, request)
+                            slots.append(admission.heavy_slot)
+                        _acquire(name, admission.slots, request)
+                        slots.append(admission.slots)
+                    except BaseException:
+                        for slot in slots:
+                            slot.release()
+                        raise
+                    run = _start(name, key, args, kwargs, slots)
+
+                try:
+                    return _wait(run, request)
+                except BrokenProcessPool:
+                    # A pool process died (e.g. killed for running out of memory).
+                    # Start a fresh pool for the next request, and answer this one
+                    # from the web worker rather than failing it
+                    logger.error("Callback pool broke while running {0}, running it in the web worker".format(name))
+                    _reset_pool(run.pool)
+                    return fn(*args, **kwargs)
+            except CallbackRejected as e:
+                if rejected is None:
+                    raise
+                return rejected(str(e))
+            finally:
+                _end_request(request)
+
+        return wrapper
+
+    return decorator
@@ -1,7 +1,16 @@
+import logging
 import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import numpy
 import pandas
 from pandas import DataFrame, Series
-from typing import List
+import pyarrow
+import pyarrow.parquet
+from typing import Callable, List, Optional, Tuple
 
 from gsiqcetl import QCETLMultiCache, QCETLCache
 import gsiqcetl.column
@@ -10,6 +19,20 @@ import gsiqcetl.common
 import pinery
 import json
 
+# Re-exported, as the views use them through this module
+from .df_utils import (
+    aggregate_unique_values,
+    is_join_key_indexed,
+    join_key,
+    left_join_on_index,
+    lookup_columns,
+    partition_by,
+    partition_rows,
+    with_join_key_index,
+)
+
+logger = logging.getLogger(__name__)
+
 ex_lib_designs = ["EX", "TS"]
 rna_lib_designs = ["MR", "SM", "TR", "WT"]
 wgs_lib_designs = ["AS", "CH", "NN", "PG", "SW", "WG"]
@@ -32,6 +55,7 @@ RUNSCANNER_FLOWCELL_COL = gsiqcetl.column.RunScannerFlowcellColumn
 PROJECT_COL = pinery.column.ProjectsColumn
 FASTQC_COL = gsiqcetl.column.FastqcColumn
 CFMEDIP_COL = gsiqcetl.column.CfMeDipQcColumn
+COMMON_COL = gsiqcetl.column.ColumnNames
 sample_type_col = "Sample Type"
 ml_col = "Merged Library"
 
@@ -63,6 +87,29 @@ rnaseqqc2_merged_columns = [RNASEQQC2_MERGED_COL.Project,
     RNASEQQC2_MERGED_COL.LibraryDesign, RNASEQQC2_MERGED_COL.TissueOrigin,
     RNASEQQC2_MERGED_COL.TissueType]
 
+""" Low-cardinality string columns that are repeated on every row of Pinery and
+of every view frame joined to it. They are stored as categoricals to cut memory
+use and speed up `isin`/`groupby`. IUS join columns (run, lane, barcode) are
+deliberately left out so that they keep the explicit types joins rely on."""
+categorical_columns = [
+    PINERY_COL.StudyTitle,
+    PINERY_COL.PrepKit,
+    PINERY_COL.TissueType,
+    PINERY_COL.TissueOrigin,
+    PINERY_COL.TissuePreparation,
+    PINERY_COL.LibrarySourceTemplateType,
+    PINERY_COL.Institute,
+    PINERY_COL.Organism,
+    PINERY_COL.SubProject,
+    PINERY_COL.SequencingControlType,
+    PINERY_COL.TargetedResequencing,
+    PINERY_COL.UMIs,
+    INSTRUMENTS_COL.ModelName,
+    INSTRUMENTS_COL.Platform,
+    COMMON_COL.Reference,
+    sample_type_col,
+]
+
 TUMOUR = "Tumour"
 BLOOD = "Blood"
 REFERENCE = "Reference"
@@ -70,24 +117,35 @@ CELL = "Cell"
 UNKNOWN = "Unknown"
 
 
-def label_sample_type(row: Series) -> str:
-    if row[PINERY_COL.TissueType] == "S":
-        return BLOOD
-    elif row[PINERY_COL.TissueType] == "R":
-        if row[PINERY_COL.TissueOrigin] == "Ly" or row[PINERY_COL.TissueOrigin] == "Pl":
-            return BLOOD
-        else:
-            return REFERENCE
-    elif row[PINERY_COL.TissueType] in ["P", "M", "O", "X", "T"]:
-        return TUMOUR
-    elif row[PINERY_COL.TissueType] == "C":
-        return CELL
-    else:
-        return UNKNOWN
+# Sample type of each tissue type. Tissue types not listed are Unknown
+tissue_type_sample_types = {
+    "S": BLOOD,
+    "R": REFERENCE,
+    "P": TUMOUR,
+    "M": TUMOUR,
+    "O": TUMOUR,
+    "X": TUMOUR,
+    "T": TUMOUR,
+    "C": CELL,
+}
+# Reference tissue from these tissue origins is Blood
+blood_reference_tissue_origins = ["Ly", "Pl"]
+
+
+def label_sample_type(df: DataFrame) -> Series:
+    """Sample type (Tumour/Reference/Blood/Cell/Unknown) of every row"""
+    tissue_type = df[PINERY_COL.TissueType]
+    sample_type = tissue_type.map(tissue_type_sample_types).fillna(UNKNOWN)
+    blood_reference = (tissue_type == "R") & df[PINERY_COL.TissueOrigin].isin(
+        blood_reference_tissue_origins)
+    sample_type[blood_reference] = BLOOD
+    return sample_type
 
 
-def label_merged_library(row: Series) -> str:
-    return "_".join([row[col] for col in pinery_merged_columns])
+def label_merged_library(df: DataFrame) -> Series:
+    """Merged library name of every row: the merged library columns joined by '_'"""
+    return df[pinery_merged_columns[0]].str.cat(
+        [df[col] for col in pinery_merged_columns[1:]], sep="_")
 
 
 def is_tumour(row: Series) -> bool:
@@ -102,6 +160,62 @@ def is_normal(row: Series) -> bool:
     return False
 
 
+def with_compact_dtypes(df: DataFrame) -> DataFrame:
+    """
+    Apply the load-time dtype policy: the `categorical_columns` present in the
+    DataFrame are converted to categoricals. Columns already categorical are left alone.
+    """
+    to_convert = {
+        col: 'category' for col in categorical_columns
+        if col in df.columns and not isinstance(df[col].dtype, pandas.CategoricalDtype)
+    }
+    if len(to_convert) == 0:
+        return df
+    return df.astype(to_convert)
+
+
+# Names of the hashed join key indexes of the Pinery DataFrames
+# Pinery columns used by the shared sidebar, graph, table and MISO builders. Views
+# pass these and their own to `get_pinery_samples`
+pinery_view_columns = [
+    PINERY_COL.SampleProvenanceID,
+    PINERY_COL.SampleName,
+    PINERY_COL.StudyTitle,
+    PINERY_COL.RootSampleName,
+    PINERY_COL.ExternalName,
+    PINERY_COL.GroupID,
+    PINERY_COL.TissueOrigin,
+    PINERY_COL.TissueType,
+    PINERY_COL.TissuePreparation,
+    PINERY_COL.LibrarySourceTemplateType,
+    PINERY_COL.PrepKit,
+    PINERY_COL.Institute,
+    PINERY_COL.SequencingControlType,
+    sample_type_col,
+]
+
+ius_key_name = "IUS Key"
+merged_key_name = "Merged Library Key"
+
+
+def project_columns(df: DataFrame, columns: List[str], key_cols: List[str]) -> DataFrame:
+    """
+    Keep only the columns a view needs, plus the columns used to join it.
+
+    Args:
+        df: The DataFrame to project
+        columns: Columns to keep. If `None`, the DataFrame is returned unchanged
+        key_cols: Join columns, which are always kept
+
+    Returns: The projected DataFrame, with the original column order
+
+    """
+    if columns is None:
+        return df
+    keep = set(columns).union(key_cols)
+    return df[[col for col in df.columns if col in keep]]
+
+
 def normalized_ius(df: DataFrame, ius_cols: List[str]):
     run_col, lane_col, barcodes_col = ius_cols
     return df.astype({
@@ -130,7 +244,7 @@ else:
     cache = QCETLMultiCache(root_dirs)
 _pinery_client = pinery.PineryClient()
 
-# Mongo Provenance can be loaded from DB or a cached hd5 DataFrame
+# Mongo Provenance can be loaded from DB or a cached sqlite DataFrame dump
 mongo_source = {}
 for s in ["MONGO_URL", "MONGO_FILE"]:
     if os.getenv(s) is not None:
@@ -140,37 +254,39 @@ if len(mongo_source) != 1:
         "Expected one source for Mango Provenance. Got {}".format(mongo_source)
     )
 
-if mongo_source.get("MONGO_URL"):
-    _provenance_client = pinery.PineryProvenanceClient(provider="pinery-miso-v7")
-    _pinery_samples = _provenance_client.get_all_samples()
-elif mongo_source.get("MONGO_FILE"):
-    _pinery_samples = pinery.load_db("sqlite:///" + mongo_source["MONGO_FILE"])
-else:
-    raise ValueError("No Mongo source specified")
+_pinery_fetch_attempts = int(os.getenv("PINERY_FETCH_ATTEMPTS", "3"))
+# Directory where processed Pinery samples are kept between starts (see `sync_provenance`)
+_pinery_snapshot_directory = os.getenv("PINERY_SNAPSHOT")
 
-# NaN sample attrs need to be changed to a str.
-# Use the expected default values
-_pinery_samples = _pinery_samples.fillna({
-    PINERY_COL.PrepKit: "Unspecified",
-    PINERY_COL.LibrarySourceTemplateType: "NN",
-    PINERY_COL.TissueOrigin: "nn",
-    PINERY_COL.TissueType: "n",
-    PINERY_COL.TissuePreparation: "Unspecified",
-    PINERY_COL.GroupID: "",
-    PINERY_COL.GroupIDDescription: "",
-    PINERY_COL.Institute: "Unspecified",
-    PINERY_COL.SequencingControlType: "Sample"
-})
-# Cast the primary key/join columns to explicit types now that the NA values are filled in
-_pinery_samples = _pinery_samples.astype({
-    PINERY_COL.SequencerRunName: 'str',
-    PINERY_COL.LaneNumber: 'int64',
-    PINERY_COL.IUSTag: 'str',
-    PINERY_COL.GroupID: 'str'})
-# Fill in the "Sample Type" column (Tumor/Reference/Blood/Unknown)
-_pinery_samples[sample_type_col] = _pinery_samples.apply(label_sample_type, axis=1)
-# Drop columns we definitely don't care about.
-_pinery_samples = _pinery_samples.drop(axis=1, columns=[
+
+def fetch_with_retries(name: str, fetch: Callable, attempts: int = _pinery_fetch_attempts):
+    """
+    Call a Pinery fetch, retrying if it fails, and log how long it took.
+
+    Args:
+        name: Name of the fetch for the logs
+        fetch: Function doing the fetch
+        attempts: Number of times to try the fetch. Use 1 for local files,
+            which won't get any better by trying again
+    """
+    for attempt in range(1, attempts + 1):
+        start = time.perf_counter()
+        try:
+            result = fetch()
+        except Exception as e:
+            if attempt >= attempts:
+                raise
+            logger.warning("Pinery fetch of {0} failed (attempt {1} of {2}): {3}".format(
+                name, attempt, attempts, e))
+            time.sleep(attempt)
+            continue
+        logger.info("Pinery fetch of {0} took {1:.2f}s".format(
+            name, time.perf_counter() - start))
+        return result
+
+
+# Provenance columns we definitely don't care about
+dropped_provenance_columns = [
     PINERY_COL.NanodropConcentration,
     PINERY_COL.QubitConcentration,
     PINERY_COL.RunIDandPosition,
@@ -193,57 +309,407 @@ _pinery_samples = _pinery_samples.drop(axis=1, columns=[
     PINERY_COL.TissueRegion,
     PINERY_COL.WorkflowType,
     PINERY_COL.Skip,
-    ])
+]
+# Provenance columns that tell whether a record changed since the Pinery snapshot
+# was saved. Dropped like the others once the snapshot is updated
+provenance_version_columns = [PINERY_COL.LastModified, PINERY_COL.Version]
+
+
+def normalize_provenance(provenance: DataFrame) -> DataFrame:
+    """
+    Fill in default values and cast the join columns. Loaders may run it as
+    they load, and running it again changes nothing.
+    """
+    # NaN sample attrs need to be changed to a str.
+    # Use the expected default values
+    samples = provenance.fillna({
+        PINERY_COL.PrepKit: "Unspecified",
+        PINERY_COL.LibrarySourceTemplateType: "NN",
+        PINERY_COL.TissueOrigin: "nn",
+        PINERY_COL.TissueType: "n",
+        PINERY_COL.TissuePreparation: "Unspecified",
+        PINERY_COL.GroupID: "",
+        PINERY_COL.GroupIDDescription: "",
+        PINERY_COL.Institute: "Unspecified",
+        PINERY_COL.SequencingControlType: "Sample"
+    })
+    # Cast the primary key/join columns to explicit types now that the NA values are filled in
+    samples = samples.astype({
+        PINERY_COL.SequencerRunName: 'str',
+        PINERY_COL.LaneNumber: 'int64',
+        PINERY_COL.IUSTag: 'str',
+        PINERY_COL.GroupID: 'str'})
+    return samples
+
+
+def process_provenance(provenance: DataFrame) -> DataFrame:
+    """
+    Turn sample provenance as fetched from Pinery into the Pinery samples Dashi
+    uses.
+    """
+    samples = normalize_provenance(provenance)
+    # Fill in the "Sample Type" column (Tumor/Reference/Blood/Unknown)
+    samples[sample_type_col] = label_sample_type(samples)
+    # Drop columns we definitely don't care about. Loaders may have left them out already
+    return samples.drop(axis=1, columns=dropped_provenance_columns, errors='ignore')
+
+
+# Rows read from the MONGO_FILE dump at a time
+_sqlite_batch_size = 50000
+
+
+def read_columns(cursor: sqlite3.Cursor, batch_size: int) -> List[numpy.ndarray]:
+    """
+    Read the rows of a query into one object array per column, `batch_size` rows
+    at a time, so neither the full set of row tuples nor a DataFrame per batch is
+    ever in memory.
+
+    Provenance repeats the same project, donor, run, kit, etc. strings on many
+    rows. Each string is replaced by the first equal one read from its column,
+    so it is stored once, until the column turns out to be mostly unique.
+    """
+    batches = [[] for _ in cursor.description]
+    seen = [{} for _ in cursor.description]
+    rows_read = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+        rows_read += len(rows)
+        for i, values in enumerate(zip(*rows)):
+            if seen[i] is not None:
+                values = [seen[i].setdefault(v, v) if type(v) is str else v for v in values]
+                if len(seen[i]) > rows_read // 2:
+                    seen[i] = None
+            array = numpy.empty(len(values), dtype=object)
+            array[:] = values
+            batches[i].append(array)
+        del rows
+    return [
+        numpy.concatenate(column) if len(column) > 0 else numpy.empty(0, dtype=object)
+        for column in batches
+    ]
+
+
+def typed_column(values: numpy.ndarray):
+    """Numbers (with NULLs) as a numeric array, like `pandas.read_sql_query` does. Other columns are left as objects"""
+    if pandas.api.types.infer_dtype(values, skipna=True) in ("integer", "floating", "mixed-integer-float"):
+        return pandas.to_numeric(values)
+    return values
+
+
+def load_provenance_sqlite(path: str) -> DataFrame:
+    """
+    Load sample provenance from the MONGO_FILE sqlite dump.
+
+    Only the columns Dashi keeps are read. Rows are streamed into column arrays
+    (see `read_columns`) and the DataFrame is built from them once, so the
+    full-width table and per-chunk copies are never in memory. Falls back to
+    `pinery.load_db` if the dump does not hold a single provenance table with the
+    expected columns.
+    """
+    with closing(sqlite3.connect("file:{0}?mode=ro".format(path), uri=True)) as conn:
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")]
+        if len(tables) == 1:
+            table = tables[0]
+            columns = [row[1] for row in conn.execute(
+                'PRAGMA table_info("{0}")'.format(table.replace('"', '""')))]
+        else:
+            columns = []
+        required = [
+            PINERY_COL.SampleProvenanceID,
+            PINERY_COL.SequencerRunName,
+            PINERY_COL.LaneNumber,
+            PINERY_COL.IUSTag,
+        ] + pinery_merged_columns
+        if not set(required).issubset(columns):
+            logger.warning("Unexpected layout of {0}, loading it in full".format(path))
+            return pinery.load_db("sqlite:///" + path)
+
+        # Record versions are only read if there is a Pinery snapshot to update
+        keep = [
+            col for col in columns
+            if col not in dropped_provenance_columns or (
+                _pinery_snapshot_directory is not None and col in provenance_version_columns)
+        ]
+        query = 'SELECT {0} FROM "{1}"'.format(
+            ", ".join('"{0}"'.format(col.replace('"', '""')) for col in keep),
+            table.replace('"', '""'))
+        arrays = read_columns(conn.execute(query), _sqlite_batch_size)
+    return normalize_provenance(DataFrame(
+        {col: typed_column(values) for col, values in zip(keep, arrays)}, columns=keep))
 
-# Helper function for the _pinery_merged_samples aggregation below.
-# Takes a list of values and converts it to a comma-separated string.
-unique_list = lambda vals: ", ".join(str(val) for val in sorted(set(vals)) if (val and val != "nan"))
 
 """ Keep only these columns after merging on @merged_library columns.
-Process the columns using the functions provided.
+Each is aggregated to a comma-separated string of its unique values.
 @merged_library columns (StudyTitle, RootSampleName, GroupID, TissueOrigin,
-TissueType, LibrarySourceTemplateType) are already included in
-the dataframe's index so they will also be retained."""
-retain_columns_after_merge = {
+TissueType, LibrarySourceTemplateType) are the group keys so they will also be retained."""
+retain_columns_after_merge = [
     # sample attributes:
-    PINERY_COL.DV200: unique_list,
-    PINERY_COL.ExternalName: unique_list,
-    PINERY_COL.Institute: unique_list,
-    PINERY_COL.Organism: unique_list,
-    PINERY_COL.RIN: unique_list,
-    PINERY_COL.SubProject: unique_list,
-    PINERY_COL.TissuePreparation: unique_list,
-    sample_type_col: unique_list,
+    PINERY_COL.DV200,
+    PINERY_COL.ExternalName,
+    PINERY_COL.Institute,
+    PINERY_COL.Organism,
+    PINERY_COL.RIN,
+    PINERY_COL.SubProject,
+    PINERY_COL.TissuePreparation,
+    sample_type_col,
     # library attributes:
-    PINERY_COL.PrepKit: unique_list,
-    PINERY_COL.TargetedResequencing: unique_list,
-    PINERY_COL.UMIs: unique_list,
-}
-    
-"""
-Converts the _pinery_samples data, where each row represents a single sequenced sample,
-to a dataframe where each row represents a "merged library" (rows are joined on the following
-PINERY_COL columns: RootSampleName (Donor), GroupID, TissueOrigin, TissueType,
-LibrarySourceTemplateType). This multi-column index will be used to join full-depth QC
-data to Pinery data.
-1. Convert NA values to empty string (because our QC data seems to use '' instead of NA for Group ID)
-2. Group the data by "merged library" columns
-3. Aggregate and transform the columns we want to keep for Dashi
-4. Reset the index to flatten the row
-"""
-_pinery_merged_samples = _pinery_samples.fillna('').groupby(by=pinery_merged_columns).agg(retain_columns_after_merge).reset_index()
-# Fill in the "Merged Library" column (used as the x-axis for merged graphs)
-_pinery_merged_samples[ml_col] = _pinery_merged_samples.apply(
-    label_merged_library, axis=1)
-
-_runs = _pinery_client.get_runs(False).runs
+    PINERY_COL.PrepKit,
+    PINERY_COL.TargetedResequencing,
+    PINERY_COL.UMIs,
+]
+
+
+def merge_provenance(samples: DataFrame) -> DataFrame:
+    """
+    Converts the Pinery samples data, where each row represents a single sequenced sample,
+    to a dataframe where each row represents a "merged library" (rows are joined on the following
+    PINERY_COL columns: RootSampleName (Donor), GroupID, TissueOrigin, TissueType,
+    LibrarySourceTemplateType). This multi-column index will be used to join full-depth QC
+    data to Pinery data.
+    1. Convert NA values to empty string (because our QC data seems to use '' instead of NA for Group ID)
+    2. Group the data by "merged library" columns
+    3. Aggregate the columns we want to keep for Dashi into unique value lists
+    """
+    merged = aggregate_unique_values(
+        samples[pinery_merged_columns + retain_columns_after_merge].fillna(''),
+        pinery_merged_columns,
+        retain_columns_after_merge
+    )
+    # Fill in the "Merged Library" column (used as the x-axis for merged graphs)
+    merged[ml_col] = label_merged_library(merged)
+    return merged
+
+
+# Bump when `process_provenance` or `merge_provenance` change, so snapshots
+# written by older code are not reused
+_provenance_snapshot_format = 1
+# Parquet schema metadata entry holding the snapshot format and ID
+_provenance_snapshot_key = b"dashi.pinery_snapshot"
+# Column of the saved samples holding each record's `provenance_versions`
+snapshot_version_col = "Provenance Version"
+
+
+def provenance_versions(provenance: DataFrame) -> Series:
+    """Last modification and version of each provenance record, by provenance ID"""
+    versions = provenance[PINERY_COL.LastModified].astype(str) + "|" + \
+        provenance[PINERY_COL.Version].astype(str)
+    return versions.set_axis(pandas.Index(provenance[PINERY_COL.SampleProvenanceID]))
+
+
+def merged_library_keys(samples: DataFrame) -> numpy.ndarray:
+    """`join_key` of the merged library each row belongs to"""
+    return join_key(samples[pinery_merged_columns].fillna(''), pinery_merged_columns)
+
+
+def snapshot_paths(directory: str) -> Tuple[str, str]:
+    """Files of the samples and merged samples in a Pinery snapshot directory"""
+    return (os.path.join(directory, "samples.parquet"),
+            os.path.join(directory, "merged.parquet"))
+
+
+def snapshot_info(table: pyarrow.Table) -> dict:
+    """Format and ID saved with a snapshot file. Empty if the file wasn't written by Dashi"""
+    metadata = table.schema.metadata or {}
+    try:
+        return json.loads(metadata.get(_provenance_snapshot_key, b"{}"))
+    except ValueError:
+        return {}
+
+
+def load_provenance_snapshot(directory: str) -> Optional[Tuple[DataFrame, DataFrame]]:
+    """
+    Load the samples (with `snapshot_version_col`) and merged samples written
+    by `save_provenance_snapshot`.
+
+    Returns: `None` if the snapshot is missing, was written by other code, or its
+        files don't belong together or lack the columns Dashi joins on
+    """
+    samples_path, merged_path = snapshot_paths(directory)
+    if not (os.path.isfile(samples_path) and os.path.isfile(merged_path)):
+        return None
+    try:
+        samples_table = pyarrow.parquet.read_table(samples_path)
+        merged_table = pyarrow.parquet.read_table(merged_path)
+    except (OSError, pyarrow.ArrowException) as e:
+        logger.warning("Ignoring unreadable Pinery snapshot in {0}: {1}".format(directory, e))
+        return None
+
+    samples_info = snapshot_info(samples_table)
+    merged_info = snapshot_info(merged_table)
+    if samples_info.get("format") != _provenance_snapshot_format or \
+            merged_info.get("format") != _provenance_snapshot_format:
+        logger.info("Ignoring Pinery snapshot in {0} from another version of Dashi".format(directory))
+        return None
+    if samples_info.get("id") != merged_info.get("id"):
+        logger.warning("Ignoring Pinery snapshot in {0}: its files were saved by different starts".format(
+            directory))
+        return None
+    missing = set(
+        [PINERY_COL.SampleProvenanceID, snapshot_version_col] + pinery_ius_columns +
+        pinery_merged_columns
+    ).difference(samples_table.column_names).union(set(
+        pinery_merged_columns + retain_columns_after_merge + [ml_col]
+    ).difference(merged_table.column_names))
+    if len(missing) > 0:
+        logger.warning("Ignoring Pinery snapshot in {0}: missing columns {1}".format(
+            directory, sorted(missing)))
+        return None
+
+    samples = samples_table.to_pandas()
+    if not samples[PINERY_COL.SampleProvenanceID].is_unique:
+        logger.warning("Ignoring Pinery snapshot in {0}: duplicate provenance IDs".format(directory))
+        return None
+    return samples, merged_table.to_pandas()
+
+
+def save_provenance_snapshot(directory: str, samples: DataFrame, merged: DataFrame):
+    """
+    Write the samples (with `snapshot_version_col`) and merged samples. Each file
+    is written to a temporary file first, so other workers never read a partial
+    one, and both are tagged with the same ID so files from different starts
+    are not mixed up.
+    """
+    info = json.dumps({"format": _provenance_snapshot_format, "id": uuid.uuid4().hex}).encode()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        for df, path in zip([samples, merged], snapshot_paths(directory)):
+            table = pyarrow.Table.from_pandas(df, preserve_index=False)
+            table = table.replace_schema_metadata(
+                {**(table.schema.metadata or {}), _provenance_snapshot_key: info})
+            temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+            try:
+                pyarrow.parquet.write_table(table, temp_path)
+                os.replace(temp_path, path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+    except (OSError, pyarrow.ArrowException) as e:
+        logger.warning("Could not save Pinery snapshot in {0}: {1}".format(directory, e))
+
+
+def sync_provenance(provenance: DataFrame, snapshot_directory: str = None) -> Tuple[DataFrame, DataFrame]:
+    """
+    Build the Pinery samples and merged samples DataFrames from sample provenance.
+
+    If a snapshot directory is given and holds a snapshot from a previous start,
+    only the provenance records that were added, changed (by LastModified/Version)
+    or removed since then are processed, and only the merged libraries they
+    belong to are aggregated again. The snapshot is then updated. If the
+    snapshot can't be used, everything is processed as without one.
+
+    Returns: Tuple of the samples and merged samples DataFrames
+    """
+    if snapshot_directory is None:
+        samples = process_provenance(provenance)
+        return samples, merge_provenance(samples)
+    if not set(provenance_version_columns).issubset(provenance.columns):
+        logger.warning("Sample provenance has no {0}, so the Pinery snapshot is not used".format(
+            " or ".join(provenance_version_columns)))
+        return sync_provenance(provenance)
+    versions = provenance_versions(provenance)
+    if not versions.index.is_unique:
+        logger.warning("Sample provenance IDs are not unique, so the Pinery snapshot is not used")
+        return sync_provenance(provenance)
+
+    def rebuild():
+        all_samples, all_merged = sync_provenance(provenance)
+        save_provenance_snapshot(
+            snapshot_directory,
+            all_samples.assign(**{snapshot_version_col: versions.to_numpy()}),
+            all_merged)
+        return all_samples, all_merged
+
+    snapshot = load_provenance_snapshot(snapshot_directory)
+    if snapshot is None:
+        return rebuild()
+    old_samples, old_merged = snapshot
+    old_samples = old_samples.set_axis(
+        pandas.Index(old_samples[PINERY_COL.SampleProvenanceID]), axis=0)
+    old_versions = old_samples.pop(snapshot_version_col)
+    if not process_provenance(provenance.iloc[:0]).columns.equals(old_samples.columns):
+        logger.info("Sample provenance columns changed, rebuilding the Pinery snapshot")
+        return rebuild()
+
+    changed = (old_versions.reindex(versions.index) != versions).to_numpy()
+    removed_ids = old_versions.index.difference(versions.index)
+    if not changed.any() and len(removed_ids) == 0:
+        logger.info("Pinery snapshot is up to date")
+        return old_samples.reindex(versions.index).reset_index(drop=True), old_merged
+
+    changed_samples = process_provenance(provenance.loc[changed])
+    changed_samples = changed_samples.set_axis(
+        pandas.Index(changed_samples[PINERY_COL.SampleProvenanceID]), axis=0)
+    samples = pandas.concat([
+        old_samples.loc[versions.index[~changed]], changed_samples
+    ]).reindex(versions.index).reset_index(drop=True)
+
+    # Merged libraries that gained, lost or changed a record
+    affected = numpy.union1d(
+        merged_library_keys(old_samples.loc[old_samples.index.isin(
+            versions.index[changed].union(removed_ids))]),
+        merged_library_keys(changed_samples)
+    )
+    merged = pandas.concat([
+        old_merged.loc[~numpy.isin(merged_library_keys(old_merged), affected)],
+        merge_provenance(samples.loc[numpy.isin(merged_library_keys(samples), affected)]),
+    ]).sort_values(by=pinery_merged_columns).reset_index(drop=True)
+
+    logger.info("Pinery snapshot updated: {0} records added or changed, {1} removed, "
+                "{2} merged libraries aggregated again".format(
+                    changed.sum(), len(removed_ids), len(affected)))
+    save_provenance_snapshot(
+        snapshot_directory,
+        samples.assign(**{snapshot_version_col: versions.to_numpy()}),
+        merged)
+    return samples, merged
+
+
+# Only sample provenance fetched over the network is retried
+if mongo_source.get("MONGO_URL"):
+    _provenance_client = pinery.PineryProvenanceClient(provider="pinery-miso-v7")
+    fetch_samples = _provenance_client.get_all_samples
+    samples_fetch_attempts = _pinery_fetch_attempts
+elif mongo_source.get("MONGO_FILE"):
+    fetch_samples = lambda: load_provenance_sqlite(mongo_source["MONGO_FILE"])
+    samples_fetch_attempts = 1
+else:
+    raise ValueError("No Mongo source specified")
+
+# The fetches are independent, so run them at the same time rather than paying
+# each one's latency in turn
+with ThreadPoolExecutor(max_workers=4) as _fetch_pool:
+    _samples_fetch = _fetch_pool.submit(
+        fetch_with_retries, "sample provenance", fetch_samples, samples_fetch_attempts)
+    _runs_fetch = _fetch_pool.submit(
+        fetch_with_retries, "runs", lambda: _pinery_client.get_runs(False).runs)
+    _instruments_fetch = _fetch_pool.submit(
+        fetch_with_retries, "instruments", _pinery_client.get_instruments_with_models)
+    _projects_fetch = _fetch_pool.submit(
+        fetch_with_retries, "projects", _pinery_client.get_projects)
+_pinery_samples, _pinery_merged_samples = sync_provenance(
+    _samples_fetch.result(), _pinery_snapshot_directory)
+
+# Annotation and aggregation above work on plain strings. Compact both frames now
+# that they are final, so every view frame joined to them inherits the categoricals.
+_pinery_samples = with_compact_dtypes(_pinery_samples)
+_pinery_merged_samples = with_compact_dtypes(_pinery_merged_samples)
+# Index by hashed join key once, so joins look up rows instead of re-hashing the
+# string key columns on every merge. Filtered copies keep the index
+_pinery_samples = with_join_key_index(_pinery_samples, pinery_ius_columns, ius_key_name)
+_pinery_merged_samples = with_join_key_index(
+    _pinery_merged_samples, pinery_merged_columns, merged_key_name)
+
+_runs = _runs_fetch.result()
 _runs[pinery.column.RunsColumn.StartDate] = pandas.to_datetime(
     _runs[pinery.column.RunsColumn.StartDate], utc=True)
 _runs[pinery.column.RunsColumn.CompletionDate] = pandas.to_datetime(
     _runs[pinery.column.RunsColumn.CompletionDate], utc=True)
 
-_instruments = _pinery_client.get_instruments_with_models()
-_projects = _pinery_client.get_projects()
+_instruments = _instruments_fetch.result()
+_projects = _projects_fetch.result()
 
 _active_projects = _projects.loc[_projects[PROJECT_COL.IsActive]]
 _active_projects = _active_projects[PROJECT_COL.Name].unique()
@@ -255,6 +721,15 @@ _runs_with_instruments = _runs.copy(deep=True).merge(
     left_on=[RUN_COL.InstrumentID],
     right_on=[INSTRUMENTS_COL.InstrumentID]
 )
+_runs_with_instruments = with_compact_dtypes(_runs_with_instruments)
+# Run columns added by `df_with_run_info`, indexed by run name
+_run_info = _runs_with_instruments[[
+    INSTRUMENTS_COL.ModelName,
+    INSTRUMENTS_COL.Platform,
+    RUN_COL.Name,
+    pinery.column.RunsColumn.StartDate,
+    pinery.column.RunsColumn.CompletionDate,
+]].set_axis(pandas.Index(_runs_with_instruments[RUN_COL.Name]), axis=0)
 
 
 def get_bcl2barcodecaller_known():
@@ -269,9 +744,16 @@ def get_bcl2barcodecaller_summary():
     return cache.load_same_version("bcl2barcodecaller").remove_missing("summary").unique("summary").copy(deep=True)
 
 
-def get_dnaseqqc_and_bamqc4():
+def get_dnaseqqc_and_bamqc4(columns: List[str] = None):
+    """
+    Get the combined DNASeqQC and BamQC4 data.
+
+    Args:
+        columns: Only keep these columns (plus the IUS join columns). All are kept if `None`.
+            Workflow versions are combined first, as that may rely on any column
+    """
     # Utility function creates new DataFrame, so no need to copy again
-    return gsiqcetl.common.utility.concat_workflow_versions(
+    return project_columns(gsiqcetl.common.utility.concat_workflow_versions(
         [
             normalized_ius(
                 cache.load_same_version("dnaseqqc").remove_missing("dnaseqqc").unique("dnaseqqc"),
@@ -280,15 +762,19 @@ def get_dnaseqqc_and_bamqc4():
             normalized_ius(cache.load_same_version("bamqc4").unique("bamqc4"), bamqc4_ius_columns),
         ],
         dnaseqqc_ius_columns,
-    )
+    ), columns, dnaseqqc_ius_columns)
 
 
-def get_cfmedip():
-    return cache.load_same_version("cfmedipqc").unique("cfmedipqc").copy(deep=True)
+def get_cfmedip(columns: List[str] = None):
+    return project_columns(
+        cache.load_same_version("cfmedipqc").unique("cfmedipqc"), columns, cfmedip_ius_columns
+    ).copy(deep=True)
 
 
-def get_cfmedip_insert_metrics():
-    return cache.load_same_version("cfmedipqc").unique("insert_metrics").copy(deep=True)
+def get_cfmedip_insert_metrics(columns: List[str] = None):
+    return project_columns(
+        cache.load_same_version("cfmedipqc").unique("insert_metrics"), columns, cfmedip_ius_columns
+    ).copy(deep=True)
 
 
 def get_crosscheckfingerprints():
@@ -304,60 +790,146 @@ def get_fastqc():
     return normalized_ius(cache.load_same_version("fastqc").unique("fastqc"), fastqc_ius_columns)
 
 
-def get_rnaseqqc2():
-    return normalized_ius(cache.load_same_version("rnaseqqc2").unique("rnaseqqc2"), rnaseqqc2_ius_columns)
+def get_rnaseqqc2(columns: List[str] = None):
+    return normalized_ius(
+        project_columns(
+            cache.load_same_version("rnaseqqc2").unique("rnaseqqc2"), columns, rnaseqqc2_ius_columns
+        ),
+        rnaseqqc2_ius_columns
+    )
 
 
 def get_runscanner_flowcell():
     return cache.load_same_version("runscannerillumina").unique("flowcell").copy(deep=True)
 
 
-def get_bamqc4_merged():
-    return normalized_merged(cache.load_same_version("bamqc4merged").unique("bamqc4merged"), bamqc4_merged_columns)
+def get_merged_qc(df: DataFrame, columns: List[str], library_designs: List[str],
+                  merged_cols: List[str], active_projects_only: bool = True) -> DataFrame:
+    """
+    Shared loading steps of the call-ready QC-ETL caches.
+
+    Args:
+        df: The cache DataFrame
+        columns: Only keep these columns (plus the merged join columns). All are kept if `None`
+        library_designs: Only keep rows with these library designs. All are kept if `None`
+        merged_cols: The merged join columns of the cache
+        active_projects_only: Only keep rows of active projects, which are the
+            only ones `get_pinery_merged_samples` serves
+
+    Returns: The filtered and normalized DataFrame
 
+    """
+    # merged_cols[0] is the project and merged_cols[3] the library design column
+    # (see `normalized_merged`)
+    mask = pinery_mask(df, active_projects_only, library_designs,
+                       merged_cols[0], merged_cols[3])
+    return normalized_merged(project_columns(df.loc[mask], columns, merged_cols), merged_cols)
+
+
+def get_bamqc4_merged(columns: List[str] = None, library_designs: List[str] = None):
+    return get_merged_qc(
+        cache.load_same_version("bamqc4merged").unique("bamqc4merged"),
+        columns,
+        library_designs,
+        bamqc4_merged_columns
+    )
 
-def get_mutect_callability():
-    return normalized_merged(
+
+def get_mutect_callability(columns: List[str] = None, library_designs: List[str] = None):
+    return get_merged_qc(
         cache.load_same_version("mutectcallability").unique("mutectcallability"),
+        columns,
+        library_designs,
         callability_merged_columns
     )
 
 
-def get_hsmetrics_merged():
-    return normalized_merged(cache.load_same_version("hsmetrics").unique("metrics"), hsmetrics_merged_columns)
+def get_hsmetrics_merged(columns: List[str] = None, library_designs: List[str] = None):
+    return get_merged_qc(
+        cache.load_same_version("hsmetrics").unique("metrics"),
+        columns,
+        library_designs,
+        hsmetrics_merged_columns
+    )
 
 
-def get_rnaseqqc2_merged():
-    return normalized_merged(
+def get_rnaseqqc2_merged(columns: List[str] = None, library_designs: List[str] = None):
+    return get_merged_qc(
         cache.load_same_version("rnaseqqc2merged").unique("rnaseqqc2merged"),
+        columns,
+        library_designs,
         rnaseqqc2_merged_columns
     )
 
 
-def get_pinery_samples(active_projects_only=True):
-    """Get Pinery Sample Provenance DataFrame"""
-    samples = _pinery_samples.copy(deep=True)
+def pinery_mask(samples: DataFrame, active_projects_only: bool, library_designs: List[str],
+                project_col: str = PINERY_COL.StudyTitle,
+                library_design_col: str = PINERY_COL.LibrarySourceTemplateType) -> Series:
+    """
+    Boolean mask selecting the rows for the requested project scope and library
+    designs. Defaults to the Pinery columns; QC-ETL caches pass their own.
+    """
+    mask = Series(True, index=samples.index)
+    if active_projects_only:
+        mask &= samples[project_col].isin(_active_projects)
+    if library_designs is not None:
+        mask &= samples[library_design_col].isin(library_designs)
+    return mask
+
+
+def get_pinery_samples(active_projects_only=True, library_designs: List[str] = None,
+                       columns: List[str] = None):
+    """
+    Get Pinery Sample Provenance DataFrame
+
+    The filters and projection are applied before copying, so only the
+    requested rows and columns are copied.
+
+    Args:
+        active_projects_only: Only serve samples for active projects, unless the
+            SAMPLES_FOR_PROJECTS environment variable is set to "all"
+        library_designs: Only serve samples with these library designs. All are served if `None`
+        columns: Only serve these columns (plus the IUS join columns). All are served if `None`
+    """
     # Serve samples for active projects unless ALL projects are requested
-    if (not active_projects_only or os.getenv("SAMPLES_FOR_PROJECTS", 'ACTIVE').lower() in ('all')):
-        return samples
-    else:
-        return samples.loc[samples[PINERY_COL.StudyTitle].isin(
-            _active_projects)]
+    if os.getenv("SAMPLES_FOR_PROJECTS", 'ACTIVE').lower() in ('all'):
+        active_projects_only = False
+    mask = pinery_mask(_pinery_samples, active_projects_only, library_designs)
+    keep = project_columns(_pinery_samples.iloc[:0], columns, pinery_ius_columns).columns
+    return _pinery_samples.loc[mask, keep].copy(deep=True)
 
 
-def get_pinery_merged_samples(active_projects_only=True):
-    samples = _pinery_merged_samples.copy(deep=True)
-    if (active_projects_only):
-        return samples.loc[samples[PINERY_COL.StudyTitle].isin(
-            _active_projects)]
-    else:
-        return samples
+def get_pinery_merged_samples(active_projects_only=True, library_designs: List[str] = None):
+    mask = pinery_mask(_pinery_merged_samples, active_projects_only, library_designs)
+    return _pinery_merged_samples.loc[mask].copy(deep=True)
 
 def get_runs():
     return _runs_with_instruments.copy(deep=True)
 
+def df_in_pinery_samples_ius(df: DataFrame, pinery_samples: DataFrame,
+                             ius_cols: List[str]) -> DataFrame:
+    """
+    Keep only the QC rows that have a matching IUS in the Pinery samples.
+
+    `df_with_pinery_samples_ius` drops unmatched rows after the join anyway. Calling
+    this as soon as the QC data is loaded means the intermediate joins and
+    calculations only touch rows that will be kept.
+    """
+    if is_join_key_indexed(pinery_samples, ius_key_name):
+        in_pinery = pinery_samples.index.get_indexer(join_key(df, ius_cols)) >= 0
+    else:
+        in_pinery = pandas.MultiIndex.from_frame(df[ius_cols]).isin(
+            pandas.MultiIndex.from_frame(pinery_samples[pinery_ius_columns]))
+    return df.loc[in_pinery].copy()
+
+
 def df_with_fastqc_data(df, merge_cols):
-    group = get_fastqc().groupby([FASTQC_COL.Run, FASTQC_COL.Lane, FASTQC_COL.Barcodes])
+    fastqc = get_fastqc()
+    fastqc_cols = [FASTQC_COL.Run, FASTQC_COL.Lane, FASTQC_COL.Barcodes]
+    # Only aggregate the FastQC rows that will be joined
+    fastqc = fastqc.loc[pandas.MultiIndex.from_frame(fastqc[fastqc_cols]).isin(
+        pandas.MultiIndex.from_frame(df[merge_cols]))]
+    group = fastqc.groupby([FASTQC_COL.Run, FASTQC_COL.Lane, FASTQC_COL.Barcodes])
     total_reads = group[FASTQC_COL.TotalSequences].sum()
     # Pick any read (1 or 2) and its total sequences are the clusters
     total_clusters = group[FASTQC_COL.TotalSequences].first().rename("Total Clusters")
@@ -375,44 +947,53 @@ def df_with_pinery_samples_ius(df: DataFrame, pinery_samples: DataFrame, ius_col
                            List[str], right_suffix='_q'):
     """Do a left merge between the DataFrame and modern Pinery samples
     data. Only samples in QC DataFrame will be kept."""
-    df = df.merge(
-        pinery_samples,
-        how="left",
-        left_on=ius_cols,
-        right_on=pinery_ius_columns,
-        suffixes=('', right_suffix)
-    )
+    if is_join_key_indexed(pinery_samples, ius_key_name):
+        df = left_join_on_index(
+            df, pinery_samples, join_key(df, ius_cols), ius_cols,
+            pinery_ius_columns, right_suffix
+        )
+    else:
+        df = df.merge(
+            pinery_samples,
+            how="left",
+            left_on=ius_cols,
+            right_on=pinery_ius_columns,
+            suffixes=('', right_suffix)
+        )
     # Drop metrics with no corresponding Pinery data. This should only happen
     # if data is very old or stale
     df = df.dropna(subset=[PINERY_COL.SampleName])
-    return df
+    return with_compact_dtypes(df)
 
 
 def df_with_pinery_samples_merged(df: DataFrame, pinery_samples: DataFrame,
     merged_cols: List[str]):
     """Do a left merge between the DataFrame and modern Pinery samples
     data. Only samples in QC DataFrame will be kept."""
-    df = df.merge(
-        pinery_samples,
-        how="left",
-        left_on=merged_cols,
-        right_on=pinery_merged_columns,
-        suffixes=('', '_q')
-    )
-    return df
+    if is_join_key_indexed(pinery_samples, merged_key_name):
+        df = left_join_on_index(
+            df, pinery_samples, join_key(df, merged_cols), merged_cols,
+            pinery_merged_columns, '_q'
+        )
+    else:
+        df = df.merge(
+            pinery_samples,
+            how="left",
+            left_on=merged_cols,
+            right_on=pinery_merged_columns,
+            suffixes=('', '_q')
+        )
+    return with_compact_dtypes(df)
 
 
 def df_with_run_info(df: DataFrame, run_col: str, right_suffix='_q'):
     """Add the instrument model column to a DataFrame."""
-    r_i = _runs_with_instruments.copy(deep=True)
+    if _run_info.index.is_unique:
+        return left_join_on_index(
+            df, _run_info, df[run_col], [run_col], [RUN_COL.Name], right_suffix
+        )
     return df.merge(
-        r_i[[
-            INSTRUMENTS_COL.ModelName,
-            INSTRUMENTS_COL.Platform,
-            RUN_COL.Name,
-            pinery.column.RunsColumn.StartDate,
-            pinery.column.RunsColumn.CompletionDate,
-        ]],
+        _run_info,
         how="left",
         left_on=run_col,
         right_on=[RUN_COL.Name],
@@ -420,6 +1001,26 @@ def df_with_run_info(df: DataFrame, run_col: str, right_suffix='_q'):
     )
 
 
+def pinery_samples_ius_lookup(pinery_samples: DataFrame) -> DataFrame:
+    """
+    Pinery samples with a unique index of IUS join keys, for `lookup_columns`
+    with `join_key` of (run, lane, barcode) columns. If an IUS has several
+    samples, the first is kept.
+    """
+    if is_join_key_indexed(pinery_samples, ius_key_name):
+        return pinery_samples
+    lookup = with_join_key_index(pinery_samples, pinery_ius_columns, ius_key_name)
+    return lookup[~lookup.index.duplicated()]
+
+
+def run_info_lookup() -> DataFrame:
+    """
+    Run columns indexed by run name, for `lookup_columns`. If a run name
+    appears several times, the first is kept.
+    """
+    return _run_info[~_run_info.index.duplicated()]
+
+
 def filter_by_library_design(df: DataFrame, library_designs: List[str],
                              ld_col=PINERY_COL.LibrarySourceTemplateType):
     return df[df[ld_col].isin(library_designs)]
@@ -0,0 +1,163 @@
+"""
+DataFrame helpers that only depend on pandas and numpy: grouping, hashed join
+keys and partitioning. Kept apart from `df_manipulation`, which loads Pinery and
+QC-ETL data when imported.
+"""
+from typing import Dict, List, Tuple
+
+import numpy
+import pandas
+from pandas import DataFrame
+
+
+def aggregate_unique_values(df: DataFrame, by: List[str], columns: List[str]) -> DataFrame:
+    """
+    Group the DataFrame and, for each column, join the sorted unique values of
+    each group into a comma-separated string. Empty and "nan" values are skipped.
+
+    Works on the factorized codes of each column, so Python objects are only
+    touched once per distinct value rather than once per row.
+
+    Args:
+        df: DataFrame without NA values
+        by: Columns to group by. They become the leading columns of the result
+        columns: Columns to aggregate
+
+    Returns: One row per group, sorted by the group columns
+
+    """
+    groups = df.groupby(by=by, sort=True)
+    group_ids = groups.ngroup().to_numpy()
+    result = groups.size().index.to_frame(index=False)
+    group_count = len(result)
+
+    for col in columns:
+        # Sorted factorization: code order is value order
+        codes, uniques = pandas.factorize(df[col], sort=True)
+        unique_count = max(len(uniques), 1)
+        labels = numpy.array([str(val) for val in uniques], dtype=object)
+        keep = numpy.array([bool(val) and val != "nan" for val in uniques], dtype=bool)
+        row_kept = codes >= 0
+        row_kept[row_kept] = keep[codes[row_kept]]
+
+        # Unique (group, value) pairs, sorted by group and then by value
+        pairs = numpy.unique(
+            group_ids[row_kept].astype(numpy.int64) * unique_count + codes[row_kept])
+        pair_groups = pairs // unique_count
+        pair_labels = labels[pairs % unique_count]
+
+        joined = numpy.full(group_count, "", dtype=object)
+        if len(pairs) > 0:
+            starts = numpy.flatnonzero(numpy.diff(pair_groups)) + 1
+            joined[pair_groups[numpy.r_[0, starts]]] = [
+                ", ".join(vals) for vals in numpy.split(pair_labels, starts)]
+        result[col] = joined
+
+    return result
+
+
+def join_key(df: DataFrame, cols: List[str]) -> numpy.ndarray:
+    """
+    Hash the join columns of each row into a single uint64 key.
+
+    Numeric columns are hashed as floats so integer and float lanes match, and
+    categorical columns hash the same as the equivalent strings.
+    """
+    key_df = df[cols].astype({
+        col: 'float64' for col in cols if pandas.api.types.is_numeric_dtype(df[col])
+    })
+    return pandas.util.hash_pandas_object(key_df, index=False).to_numpy()
+
+
+def with_join_key_index(df: DataFrame, cols: List[str], key_name: str) -> DataFrame:
+    """Index the DataFrame by the `join_key` of the given columns"""
+    return df.set_axis(pandas.Index(join_key(df, cols), name=key_name), axis=0)
+
+
+def is_join_key_indexed(df: DataFrame, key_name: str) -> bool:
+    """If the DataFrame has a unique join key index, so can be joined with `left_join_on_index`"""
+    return df.index.name == key_name and df.index.is_unique
+
+
+def left_join_on_index(df: DataFrame, right: DataFrame, left_key: numpy.ndarray,
+                       left_on: List[str], right_on: List[str], right_suffix: str) -> DataFrame:
+    """
+    Left join to a DataFrame with a unique index, by looking up each row's key
+    in that index and taking the matching rows.
+
+    The result is the same as `df.merge(right, how="left", left_on=left_on,
+    right_on=right_on, suffixes=('', right_suffix))`: left columns then right
+    columns, same-named join columns combined, other shared columns suffixed,
+    unmatched rows NA and a fresh RangeIndex.
+
+    Args:
+        df: The left DataFrame
+        right: The DataFrame to join, with a unique index of keys
+        left_key: The key of each `df` row, comparable to the `right` index
+        left_on: The `df` join columns
+        right_on: The `right` join columns
+        right_suffix: Suffix for `right` columns that are also in `df`
+    """
+    indexer = right.index.get_indexer(left_key)
+    right = right.reset_index(drop=True).drop(
+        columns=[r for l, r in zip(left_on, right_on) if l == r])
+    # Missing keys (-1) are not in the RangeIndex, so become NA rows
+    right = right.reindex(indexer)
+    shared = df.columns.intersection(right.columns)
+    right = right.rename(columns={col: col + right_suffix for col in shared})
+    left = df.reset_index(drop=True)
+    right.index = left.index
+    return pandas.concat([left, right], axis=1)
+
+
+def lookup_columns(right: DataFrame, keys, columns: List[str], suffix: str = '') -> DataFrame:
+    """
+    Look up keys in a DataFrame with a unique index and gather some of its
+    columns, so a row can take the same columns for several roles (e.g. the
+    query and the match library) without merging the full DataFrame each time.
+
+    Args:
+        right: The DataFrame to look up, with a unique index of keys
+        keys: The keys to look up, comparable to the `right` index
+        columns: The `right` columns to gather
+        suffix: Appended to the gathered column names
+
+    Returns: A DataFrame with a row per key and a RangeIndex. Rows of missing
+        keys are NA
+    """
+    indexer = right.index.get_indexer(keys)
+    found = right[columns].reset_index(drop=True).reindex(indexer)
+    found.index = pandas.RangeIndex(len(found))
+    return found.add_suffix(suffix)
+
+
+def partition_by(df: DataFrame, col: str) -> Tuple[DataFrame, Dict[str, slice]]:
+    """
+    Group the rows of a DataFrame by the values of a column, so the rows of a
+    value can be taken as a slice instead of comparing the whole column.
+
+    Args:
+        df: The DataFrame to partition
+        col: The column to partition by
+
+    Returns: The DataFrame with the rows of each value together (keeping
+        their original order and index), and the slice of rows of each value.
+        Use with `partition_rows`
+
+    """
+    codes, values = pandas.factorize(df[col])
+    # Missing values (-1) come first and get no slice
+    order = numpy.argsort(codes, kind="stable")
+    counts = numpy.bincount(codes[codes >= 0], minlength=len(values))
+    ends = numpy.cumsum(counts) + numpy.count_nonzero(codes < 0)
+    starts = ends - counts
+    slices = {
+        value: slice(start, end)
+        for value, start, end in zip(values, starts.tolist(), ends.tolist())
+    }
+    return df.iloc[order], slices
+
+
+def partition_rows(df: DataFrame, slices: Dict[str, slice], value) -> DataFrame:
+    """The rows of a DataFrame partitioned by `partition_by` that have a value"""
+    return df.iloc[slices.get(value, slice(0, 0))]
@@ -0,0 +1,102 @@
+"""
+Groups libraries into inferred identities (individuals) from fingerprint
+comparisons: two libraries whose fingerprints match are from the same
+individual, and so are all libraries connected through matches.
+
+The groups are kept in a union-find structure, so matches are joined in one
+pass and the identity of a library is found in (nearly) constant time.
+"""
+from typing import Dict, Iterable, List, Optional
+
+from pandas import DataFrame
+
+
+class IdentityIndex:
+    def __init__(self):
+        # Libraries are numbered in the order they are first seen
+        self.codes: Dict[str, int] = {}
+        self.libraries: List[str] = []
+        self.parent: List[int] = []
+        # Libraries of each identity, by the identity's root library
+        self.members: Dict[int, List[int]] = {}
+
+    def __len__(self):
+        return len(self.libraries)
+
+    def code(self, library: str) -> int:
+        """The number of a library, adding it as its own identity if it is new"""
+        code = self.codes.get(library)
+        if code is None:
+            code = len(self.libraries)
+            self.codes[library] = code
+            self.libraries.append(library)
+            self.parent.append(code)
+            self.members[code] = [code]
+        return code
+
+    def add_libraries(self, libraries: Iterable[str]):
+        """Add libraries, each its own identity until a match joins it to others"""
+        for library in libraries:
+            self.code(library)
+
+    def find(self, code: int) -> int:
+        """The root library of the identity of a library"""
+        parent = self.parent
+        while parent[code] != code:
+            # Path halving keeps later lookups short
+            parent[code] = parent[parent[code]]
+            code = parent[code]
+        return code
+
+    def union(self, a: int, b: int) -> bool:
+        """Join the identities of two libraries. Returns False if they were already joined"""
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return False
+        # Attach the smaller identity to the larger one
+        if len(self.members[a]) < len(self.members[b]):
+            a, b = b, a
+        self.parent[b] = a
+        self.members[a].extend(self.members.pop(b))
+        return True
+
+    def add_matches(self, query_libraries: Iterable[str], match_libraries: Iterable[str]) -> int:
+        """
+        Add pairs of libraries with matching fingerprints.
+
+        Returns: The number of pairs that joined two identities
+        """
+        joined = 0
+        for query, match in zip(query_libraries, match_libraries):
+            if self.union(self.code(query), self.code(match)):
+                joined += 1
+        return joined
+
+    def identity(self, library: str) -> Optional[int]:
+        """The identity of a library, or None if it has not been seen"""
+        code = self.codes.get(library)
+        if code is None:
+            return None
+        return self.find(code)
+
+    def identity_libraries(self, library: str) -> List[str]:
+        """All the libraries with the same identity as a library"""
+        identity = self.identity(library)
+        if identity is None:
+            return []
+        return [self.libraries[c] for c in self.members[identity]]
+
+    def to_frame(self, library_col: str, identity_col: str) -> DataFrame:
+        """
+        Each library and its identity. Identities are named after their
+        alphabetically first library.
+        """
+        names = {
+            root: min(self.libraries[c] for c in members)
+            for root, members in self.members.items()
+        }
+        return DataFrame({
+            library_col: self.libraries,
+            identity_col: [names[self.find(c)] for c in range(len(self.libraries))],
+        })
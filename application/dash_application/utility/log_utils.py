@@ -25,6 +25,8 @@ def log_filters(params, collapsing_functions, logger):
     collapse_all_params(params, collapsing_functions)
     del params['click']
     del params['click2']
+    # Only tells the requests of browser tabs apart
+    params.pop('tab_id', None)
     if 'end_date' in params and params['end_date'] and datetime.datetime.strptime(params['end_date'], '%Y-%m-%d').date() == datetime.date.today():
         del params['end_date']
     logger.info(json.dumps(params))
\ No newline at end of file
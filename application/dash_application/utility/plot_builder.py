@@ -1,5 +1,6 @@
 from typing import List, Tuple, Union, Dict, Callable
 
+import numpy
 import pandas
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
@@ -78,6 +79,10 @@ CUTOFF_LINE_COLOURS = [
 
 BIG_MARKER_SIZE = 20
 
+# Single-lane plots place each sample at its position in the sorted DataFrame,
+# as several libraries can share a sample name
+SAMPLE_POSITION_COL = "Sample Position"
+
 DATA_LABEL_ORDER = [
     PINERY_COL.SampleName,
     PINERY_COL.RootSampleName,
@@ -161,6 +166,53 @@ def add_graphable_cols(
     return df
 
 
+def sort_rank_col(col: str) -> str:
+    """Name of the column holding the sort rank of another column"""
+    return "{0} Sort Rank".format(col)
+
+
+def add_sort_ranks(df: DataFrame, sort_options: List[Dict]) -> DataFrame:
+    """
+    Add a dense rank column for each sort option, matching the order given by
+    `DataFrame.sort_values` (missing values last). Reshaping can then order any
+    filtered subset by integer ranks instead of sorting the selected columns.
+
+    Args:
+        df: The view DataFrame
+        sort_options: The view's sort dropdown options
+
+    Returns: DataFrame with a rank column per sortable column
+    """
+    ranks = {}
+    for option in sort_options:
+        col = option["value"]
+        if col not in df.columns or col in ranks:
+            continue
+        values = df[col].reset_index(drop=True).sort_values(kind="stable")
+        previous = values.shift()
+        changed = values.ne(previous) & ~(values.isna() & previous.isna())
+        if len(changed) > 0:
+            changed.iloc[0] = True
+        rank = numpy.empty(len(df), dtype="int32")
+        rank[values.index.to_numpy()] = changed.cumsum().to_numpy()
+        ranks[sort_rank_col(col)] = rank
+    return df.assign(**ranks)
+
+
+def sort_by_columns(df: DataFrame, first_sort: str, second_sort: str) -> DataFrame:
+    """
+    Stable sort by two columns, using the rank columns from `add_sort_ranks`
+    where available.
+    """
+    first_rank = sort_rank_col(first_sort)
+    second_rank = sort_rank_col(second_sort)
+    if first_rank not in df.columns or second_rank not in df.columns:
+        return df.sort_values(by=[first_sort, second_sort])
+    second = df[second_rank].to_numpy(dtype="int64")
+    key = df[first_rank].to_numpy(dtype="int64") * (second.max(initial=0) + 1) + second
+    return df.iloc[numpy.argsort(key, kind="stable")]
+
+
 def fill_in_shape_col(df: DataFrame, shape_col: str, shape_or_colour_values:
         dict):
     if df.empty:
@@ -282,10 +334,8 @@ def reshape_single_lane_df(df, runs, instruments, projects, references, kits, li
         df = df[df[pinery.column.SampleProvenanceColumn.LibrarySourceTemplateType].isin(
             library_designs)]
     df = df[df[pinery.column.SampleProvenanceColumn.SequencerRunName].isin(runs_in_range(start_date, end_date))]
-    sort_by = [first_sort, second_sort]
-    df = df.sort_values(by=sort_by)
-    df["SampleNameExtra"] = df[PINERY_COL.SampleName].str.cat(
-        [str(x) for x in range(len(df))], sep=".")
+    df = sort_by_columns(df, first_sort, second_sort)
+    df[SAMPLE_POSITION_COL] = range(len(df))
     df = fill_in_shape_col(df, shape_by, shape_or_colour_values)
     df = fill_in_colour_col(df, colour_by, shape_or_colour_values, searchsample)
     df = fill_in_size_col(df, searchsample)
@@ -311,8 +361,7 @@ def reshape_call_ready_df(df, projects, references, tissue_preps, sample_types,
     if sample_types:
         df = df[df[sample_type_col].isin(sample_types)]
 
-    sort_by = [first_sort, second_sort]
-    df = df.sort_values(by=sort_by)
+    df = sort_by_columns(df, first_sort, second_sort)
     df = fill_in_shape_col(df, shape_by, shape_or_colour_values)
     df = fill_in_colour_col(
         df, colour_by, shape_or_colour_values, searchsample, REPORT_TYPE["Call-Ready"]
@@ -355,7 +404,7 @@ def generate(title_text, sorted_data, y_fn, axis_text, colourby, shapeby,
 
     if x_fn is None:
         if page_mode == Mode.IUS:
-            x_fn = lambda d: d["SampleNameExtra"]
+            x_fn = lambda d: d[SAMPLE_POSITION_COL]
             display_x = lambda d: d[PINERY_COL.SampleName]
         elif page_mode == Mode.MERGED:
             x_fn = lambda d: d[ml_col]
@@ -393,16 +442,22 @@ def generate(title_text, sorted_data, y_fn, axis_text, colourby, shapeby,
         'rangemode': 'nonnegative' if is_empty_plot(traces) else 'normal'
     }
 
+    x_axis = {
+        'visible': False,
+        'rangemode': 'normal',
+        'autorange': True,
+    }
+    # Sample positions are already in order
+    if page_mode != Mode.IUS:
+        x_axis['categoryorder'] = 'array'
+        x_axis['categoryarray'] = x_fn(sorted_data)
+
     return go.Figure(
         data = traces,
         layout = go.Layout(
             title=title_text,
             margin=margin,
-            xaxis={'visible': False,
-                   'rangemode': 'normal',
-                   'autorange': True,
-                   'categoryorder': 'array',
-                   'categoryarray': x_fn(sorted_data)},
+            xaxis=x_axis,
             yaxis=y_axis,
             legend = {
                 'tracegroupgap': 0,
@@ -439,7 +494,8 @@ def _generate_traces(
         )]
 
     traces = []
-    grouped_data = sorted_data.groupby([colourby, shapeby]) #Unfortunately necessary
+    # Colour/shape columns can be categorical. Only group on values that are present
+    grouped_data = sorted_data.groupby([colourby, shapeby], observed=True) #Unfortunately necessary
     if colourby == shapeby:
         name_format = lambda n: "{0}".format(n[0])
     else:
@@ -572,7 +628,7 @@ def generate_bar(df, criteria, x_fn, y_fn, title_text, yaxis_text, fill_color: D
 
 def generate_line(df, criteria, x_fn, y_fn, title_text, yaxis_text, xaxis_text=None):
     graphs = []
-    for name, df in df.groupby(criteria):
+    for name, df in df.groupby(criteria, observed=True):
         graph = go.Scattergl(
             name = '<br>'.join(str(x) for x in name) + '<br>',
             x = x_fn(df),
@@ -937,7 +993,7 @@ class Subplot:
         self.display_x = None
         if self.x_fn is None:
             if self.mode == Mode.IUS:
-                self.x_fn = lambda d: d["SampleNameExtra"]
+                self.x_fn = lambda d: d[SAMPLE_POSITION_COL]
                 self.display_x = lambda d: d[PINERY_COL.SampleName]
             elif self.mode == Mode.MERGED:
                 self.x_fn = lambda d: d[ml_col]
@@ -1047,14 +1103,22 @@ def generate_plot_with_subplots(subplots: List[Subplot]):
         for t in trace:
             fig.add_trace(t, row=i+1, col=1)
 
-    fig.update_xaxes(
-        visible=False,
-        rangemode="normal",
-        autorange=True,
-        # The x-axis is shared, so order all plots based on first one
-        categoryorder='array',
-        categoryarray=subplots[0].x_fn(subplots[0].df),
-    )
+    if subplots[0].mode == Mode.IUS:
+        # Samples are plotted at their positions in the sorted DataFrame
+        fig.update_xaxes(
+            visible=False,
+            rangemode="normal",
+            autorange=True,
+        )
+    else:
+        fig.update_xaxes(
+            visible=False,
+            rangemode="normal",
+            autorange=True,
+            # The x-axis is shared, so order all plots based on first one
+            categoryorder='array',
+            categoryarray=subplots[0].x_fn(subplots[0].df),
+        )
 
     for i, subplot in enumerate([subplot for subplot in subplots]):
         y_type = "log" if subplot.log_y else "linear"
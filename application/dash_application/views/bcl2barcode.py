@@ -2,7 +2,6 @@ from dash import html
 from dash import dcc as core
 from dash import dash_table
 from dash.dependencies import Input, Output
-import pandas
 
 from ..utility import df_manipulation as util
 from ..dash_id import init_ids
@@ -26,13 +25,16 @@ ids = init_ids(
 )
 
 DATAVERSION = util.cache.versions(["bcl2barcodecaller"])
-known = util.get_bcl2barcodecaller_known()
-unknown = util.get_bcl2barcodecaller_unknown()
-summary = util.get_bcl2barcodecaller_summary()
+# Rows are grouped by run, so the rows of a run are a slice
+known, known_runs = util.partition_by(
+    util.get_bcl2barcodecaller_known(), util.BCL_KNOWN.Run)
+unknown, unknown_runs = util.partition_by(
+    util.get_bcl2barcodecaller_unknown(), util.BCL_UNKNOWN.Run)
+summary, summary_runs = util.partition_by(
+    util.get_bcl2barcodecaller_summary(), util.BCL_SUMMARY.Run)
 
 # In case there is a run that is all unknown barcodes
-all_runs = pandas.concat([known[util.BCL_KNOWN.Run], unknown[util.BCL_UNKNOWN.Run]]).unique()
-all_runs = sorted(all_runs, reverse=True)
+all_runs = sorted(set(known_runs).union(unknown_runs), reverse=True)
 
 KNOWN_DATA_TABLE_COLS = [
     {"name": "Library", "id": util.BCL_KNOWN.LibraryAlias},
@@ -128,8 +130,8 @@ def init_callbacks(dash_app):
             functions update_known_index_bar, update_unknown_index_bar,
             update_pie_chart's data value, and update_pie_chart's fraction value
         """
-        known_run = known[known[util.BCL_KNOWN.Run] == run_alias]
-        unknown_run = unknown[unknown[util.BCL_UNKNOWN.Run] == run_alias]
+        known_run = util.partition_rows(known, known_runs, run_alias)
+        unknown_run = util.partition_rows(unknown, unknown_runs, run_alias)
 
         return (
             create_known_index_bar(known_run),
@@ -207,8 +209,9 @@ def create_unknown_index_bar(run):
 
 
 def create_pie_chart(run_alias):
-    known_count = summary[summary[util.BCL_SUMMARY.Run] == run_alias][util.BCL_SUMMARY.KnownClusters]
-    unknown_count = summary[summary[util.BCL_SUMMARY.Run] == run_alias][util.BCL_SUMMARY.UnknownClusters]
+    run_summary = util.partition_rows(summary, summary_runs, run_alias)
+    known_count = run_summary[util.BCL_SUMMARY.KnownClusters]
+    unknown_count = run_summary[util.BCL_SUMMARY.UnknownClusters]
 
     if len(known_count) > 0 and len(unknown_count) > 0:
         known_count = known_count.iloc[0]
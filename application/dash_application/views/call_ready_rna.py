@@ -10,6 +10,7 @@ from ..utility.table_builder import table_tabs_call_ready, cutoff_table_data_mer
 from ..utility import df_manipulation as util
 from ..utility import sidebar_utils
 from ..utility import log_utils
+from ..utility.callback_pool import offload, rejected_figure, row_count_cost, tab_store_id
 
 logger = logging.getLogger(__name__)
 
@@ -70,17 +71,30 @@ special_cols = {
     "LDIs": "LDIs",
 }
 
+# RNASeqQC columns used by this view. The rest are dropped as soon as the data is loaded
+rnaseqqc_columns = [
+    RNASEQQC2_COL.Donor,
+    RNASEQQC2_COL.FileSWID,
+    RNASEQQC2_COL.InsertMean,
+    RNASEQQC2_COL.MergedPineryLimsID,
+    RNASEQQC2_COL.MetricsMedian5PrimeTo3PrimeBias,
+    RNASEQQC2_COL.MetricsPercentCodingBases,
+    RNASEQQC2_COL.MetricsPercentCorrectStrandReads,
+    RNASEQQC2_COL.RRnaContaminationMapped,
+    RNASEQQC2_COL.Reference,
+    RNASEQQC2_COL.TotalClusters,
+    RNASEQQC2_COL.TotalReads,
+]
+
+
 def get_merged_rna_data():
     """
     Join together the RNAseqQC and Pinery dataframes
     """
     # Sample metadata from Pinery
-    pinery_samples = util.get_pinery_merged_samples()
-    pinery_samples = util.filter_by_library_design(pinery_samples, util.rna_lib_designs)
+    pinery_samples = util.get_pinery_merged_samples(library_designs=util.rna_lib_designs)
 
-    rna_df = util.get_rnaseqqc2_merged()
-    rna_df = util.filter_by_library_design(rna_df, util.rna_lib_designs,
-                                           RNASEQQC2_COL.LibraryDesign)
+    rna_df = util.get_rnaseqqc2_merged(rnaseqqc_columns, util.rna_lib_designs)
 
     rna_df[special_cols["Pipeline Filtered Clusters"]] = round(
         rna_df[RNASEQQC2_COL.TotalClusters] / 1e6, 3)
@@ -182,6 +196,8 @@ SORT_BY = shape_colour.dropdown() + [
      "value": util.ml_col}
 ]
 
+RNA_DF = add_sort_ranks(RNA_DF, SORT_BY)
+
 def generate_total_clusters(df, graph_params):
     return CallReadySubplot(
         "Pipeline Filtered Clusters",
@@ -425,8 +441,17 @@ def init_callbacks(dash_app):
             State(ids["rrna-contam-cutoff"], "value"),
             State(ids["percent-mapped-to-coding-cutoff"], "value"),
             State('url', 'search'),
+            State(tab_store_id, 'data'),
         ]
     )
+    @offload(
+        ignored_args=2,
+        dataversion=dataversion,
+        cost=row_count_cost(RNA_DF, PINERY_COL.StudyTitle, 2, len(GRAPHS)),
+        rejected=rejected_figure(8, 0),
+        selections=["projects", "references", "tissue_materials", "sample_types",
+                    "search_sample", "searchsampleext"]
+    )
     def update_pressed(click,
                        click2,
                        projects,
@@ -444,7 +469,8 @@ def init_callbacks(dash_app):
                        clusters_per_sample_cutoff,
                        rrna_contam_cutoff,
                        percent_mapped_to_coding_cutoff,
-                       search_query):
+                       search_query,
+                       tab_id):
         log_utils.log_filters(locals(), collapsing_functions, logger)
         if search_sample and searchsampleext:
             search_sample += searchsampleext
@@ -10,6 +10,7 @@ from ..utility.table_builder import table_tabs_call_ready, cutoff_table_data_mer
 from ..utility import df_manipulation as util
 from ..utility import sidebar_utils
 from ..utility import log_utils
+from ..utility.callback_pool import offload, rejected_figure, row_count_cost, tab_store_id
 
 logger = logging.getLogger(__name__)
 
@@ -79,6 +80,38 @@ special_cols = {
 }
 
 
+# QC columns used by this view, across BamQC, Callability and HsMetrics. The rest
+# are dropped as soon as the data is loaded. The list is shared by all sources so
+# that duplicate columns are resolved the same way during the joins
+qc_columns = [
+    BAMQC_COL.AverageReadLength,
+    BAMQC_COL.Coverage,
+    BAMQC_COL.CoverageDeduplicated,
+    BAMQC_COL.Donor,
+    BAMQC_COL.FileSWID,
+    BAMQC_COL.InsertMean,
+    BAMQC_COL.Library,
+    BAMQC_COL.MarkDuplicates_PERCENT_DUPLICATION,
+    BAMQC_COL.Reference,
+    BAMQC_COL.TargetFile,
+    BAMQC_COL.TotalClusters,
+    BAMQC_COL.TotalReads,
+    BAMQC_COL.TotalTargetSize,
+    CALL_COL.Callability,
+    CALL_COL.FileSWID,
+    CALL_COL.NormalMinCoverage,
+    CALL_COL.TumorMinCoverage,
+    HSMETRICS_COL.AtDropout,
+    HSMETRICS_COL.FileSWID,
+    HSMETRICS_COL.GCDropout,
+    HSMETRICS_COL.HsLibrarySize,
+    HSMETRICS_COL.MeanBaitCoverage,
+    HSMETRICS_COL.PctExcOverlap,
+    HSMETRICS_COL.PctSelectedBases,
+    HSMETRICS_COL.Reference,
+]
+
+
 def get_merged_ts_data():
     """"
     Join together all the dataframes needed for graphing:
@@ -89,17 +122,11 @@ def get_merged_ts_data():
     """
 
     # Sample metadata from Pinery
-    pinery_samples = util.get_pinery_merged_samples()
-    pinery_samples = util.filter_by_library_design(pinery_samples, util.ex_lib_designs)
+    pinery_samples = util.get_pinery_merged_samples(library_designs=util.ex_lib_designs)
 
-    hsmetrics_df = util.get_hsmetrics_merged()
-    hsmetrics_df = util.filter_by_library_design(hsmetrics_df, util.ex_lib_designs, HSMETRICS_COL.LibraryDesign)
-
-    callability_df = util.get_mutect_callability()
-    callability_df = util.filter_by_library_design(callability_df, util.ex_lib_designs, CALL_COL.LibraryDesign)
-
-    bamqc4_df = util.get_bamqc4_merged()
-    bamqc4_df = util.filter_by_library_design(bamqc4_df, util.ex_lib_designs, BAMQC_COL.LibraryDesign)
+    hsmetrics_df = util.get_hsmetrics_merged(qc_columns, util.ex_lib_designs)
+    callability_df = util.get_mutect_callability(qc_columns, util.ex_lib_designs)
+    bamqc4_df = util.get_bamqc4_merged(qc_columns, util.ex_lib_designs)
 
     bamqc4_df[special_cols["Pipeline Filtered Clusters"]] = round(
         bamqc4_df[BAMQC_COL.TotalClusters] / 1e6, 3)
@@ -240,6 +267,8 @@ SORT_BY = shape_colour.dropdown() + [
      "value": util.ml_col}
 ]
 
+TS_DF = add_sort_ranks(TS_DF, SORT_BY)
+
 def generate_total_clusters(df, graph_params):
     return CallReadySubplot(
         "Pipeline Filtered Clusters",
@@ -557,8 +586,17 @@ def init_callbacks(dash_app):
             State(ids["pf-tumour-cutoff"], "value"),
             State(ids["pf-normal-cutoff"], "value"),
             State('url', 'search'),
+            State(tab_store_id, 'data'),
         ]
     )
+    @offload(
+        ignored_args=2,
+        dataversion=dataversion,
+        cost=row_count_cost(TS_DF, PINERY_COL.StudyTitle, 2, len(GRAPHS)),
+        rejected=rejected_figure(8, 0),
+        selections=["projects", "references", "tissue_materials", "sample_types",
+                    "search_sample", "searchsampleext"]
+    )
     def update_pressed(click,
                        click2,
                        projects,
@@ -579,7 +617,8 @@ def init_callbacks(dash_app):
                        insert_mean_cutoff,
                        pf_tumour_cutoff,
                        pf_normal_cutoff,
-                       search_query):
+                       search_query,
+                       tab_id):
         log_utils.log_filters(locals(), collapsing_functions, logger)
         if search_sample and searchsampleext:
             search_sample += searchsampleext
@@ -10,6 +10,7 @@ from ..utility.plot_builder import *
 from ..utility.table_builder import table_tabs_call_ready, cutoff_table_data_merged
 from ..utility import df_manipulation as util
 from ..utility import sidebar_utils, log_utils
+from ..utility.callback_pool import offload, rejected_figure, row_count_cost, tab_store_id
 
 logger = logging.getLogger(__name__)
 
@@ -77,6 +78,31 @@ special_cols = {
 }
 
 
+# QC columns used by this view, across BamQC and Callability. The rest are dropped
+# as soon as the data is loaded. The list is shared by both sources so that
+# duplicate columns are resolved the same way during the joins
+qc_columns = [
+    BAMQC_COL.AverageReadLength,
+    BAMQC_COL.CoverageDeduplicated,
+    BAMQC_COL.CoverageMedian,
+    BAMQC_COL.CoverageMedian10Percentile,
+    BAMQC_COL.CoverageMedian90Percentile,
+    BAMQC_COL.Donor,
+    BAMQC_COL.FileSWID,
+    BAMQC_COL.InsertMean,
+    BAMQC_COL.InsertMedian,
+    BAMQC_COL.Library,
+    BAMQC_COL.MarkDuplicates_PERCENT_DUPLICATION,
+    BAMQC_COL.Reference,
+    BAMQC_COL.TotalClusters,
+    BAMQC_COL.TotalReads,
+    CALL_COL.Callability,
+    CALL_COL.FileSWID,
+    CALL_COL.NormalMinCoverage,
+    CALL_COL.TumorMinCoverage,
+]
+
+
 def get_merged_wgs_data():
     """
     Join together all the dataframes needed for graphing:
@@ -85,17 +111,11 @@ def get_merged_wgs_data():
       * Instruments (to allow filtering by instrument model)
       * Runs (needed to join Pinery to Instruments)
     """
-    # Pull in sample metadata from Pinery.
-    pinery_samples = util.get_pinery_merged_samples()
-    # Filter the Pinery samples for WG samples and others which will have BAM files generated.
-    pinery_samples = util.filter_by_library_design(pinery_samples,
-                                                   util.wgs_lib_designs)
-
-    callability_df = util.get_mutect_callability()
-    callability_df = util.filter_by_library_design(callability_df,
-                                                   util.wgs_lib_designs,
-                                                   CALL_COL.LibraryDesign)
-    bamqc4_df = util.get_bamqc4_merged()
+    # Pull in sample metadata from Pinery for WG samples and others which will have BAM files generated.
+    pinery_samples = util.get_pinery_merged_samples(library_designs=util.wgs_lib_designs)
+
+    callability_df = util.get_mutect_callability(qc_columns, util.wgs_lib_designs)
+    bamqc4_df = util.get_bamqc4_merged(qc_columns, util.wgs_lib_designs)
 
     callability_df[special_cols["Percent Callability"]] = round(
         callability_df[CALL_COL.Callability] * 100.0, 3)
@@ -241,6 +261,8 @@ SORT_BY = shape_colour.dropdown() + [
     }
 ]
 
+WGS_DF = add_sort_ranks(WGS_DF, SORT_BY)
+
 
 def generate_total_clusters(df, graph_params):
     return CallReadySubplot(
@@ -540,8 +562,17 @@ def init_callbacks(dash_app):
             State(ids["cutoff-mean-insert"], "value"),
             State(ids["cutoff-duplicate-rate"], "value"),
             State('url', 'search'),
+            State(tab_store_id, 'data'),
         ]
     )
+    @offload(
+        ignored_args=2,
+        dataversion=dataversion,
+        cost=row_count_cost(WGS_DF, PINERY_COL.StudyTitle, 2, len(GRAPHS)),
+        rejected=rejected_figure(8, 0),
+        selections=["projects", "references", "tissue_materials", "sample_types",
+                    "search_sample", "searchsampleext"]
+    )
     def update_pressed(click,
                        click2,
                        projects,
@@ -560,7 +591,8 @@ def init_callbacks(dash_app):
                        callability_cutoff,
                        insert_mean_cutoff,
                        duplicate_rate_cutoff,
-                       search_query):
+                       search_query,
+                       tab_id):
         log_utils.log_filters(locals(), collapsing_functions, logger)
         if search_sample and searchsampleext:
             search_sample += searchsampleext
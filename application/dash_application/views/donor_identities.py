@@ -0,0 +1,315 @@
+from dash import dcc as core
+from dash import html
+from dash.dependencies import Input, Output, State
+from dash import dash_table
+from collections import namedtuple
+import pinery
+import pandas
+import threading
+import logging
+import gevent
+from gevent.monkey import get_original, is_module_patched
+
+from ..dash_id import init_ids
+from ..utility import df_manipulation, sidebar_utils
+from ..utility.df_manipulation import CROSSCHECKFINGERPRINTS_COL as COL
+from ..utility.identity_index import IdentityIndex
+
+logger = logging.getLogger(__name__)
+
+PINERY_COL = pinery.column.SampleProvenanceColumn
+
+page_name = "donor_identities"
+title = "Donor Identities"
+
+# Libraries with an LOD score above this are from the same individual, and below
+# its negative from different individuals. Matches the edge of the ambiguous
+# zone in the Sample Swaps view
+MATCH_LOD = 20
+
+ids = init_ids([
+    # Buttons
+    'update-button-top',
+
+    # Sidebar
+    "all-projects",
+    "checkbox_show_mismatches",
+    "projects-list",
+
+    # Main Table
+    "table",
+])
+
+special_cols = {
+    "library": "LIBRARY",
+    "identity": "IDENTITY",
+    "identity_libraries": "IDENTITY_LIBRARIES",
+    "identity_donors": "IDENTITY_DONORS",
+    "donor_identities": "DONOR_IDENTITIES",
+    "mismatch": "MISMATCH",
+}
+
+rename_columns = {
+    PINERY_COL.StudyTitle: 'PROJECT',
+    PINERY_COL.RootSampleName: 'DONOR',
+}
+
+pinery_samples = df_manipulation.pinery_samples_ius_lookup(
+    df_manipulation.get_pinery_samples(
+        columns=[PINERY_COL.StudyTitle, PINERY_COL.RootSampleName])
+)
+
+
+def library_donors(crosscheck):
+    """The project and donor of each library in the comparisons, from Pinery"""
+    libraries = []
+    for library_col, ius_cols in [
+        (COL.QueryLibrary, [COL.QueryRun, COL.QueryLane, COL.QueryBarcode]),
+        (COL.MatchLibrary, [COL.MatchRun, COL.MatchLane, COL.MatchBarcode]),
+    ]:
+        found = df_manipulation.lookup_columns(
+            pinery_samples,
+            df_manipulation.join_key(crosscheck, ius_cols),
+            [PINERY_COL.StudyTitle, PINERY_COL.RootSampleName]
+        )
+        found[special_cols["library"]] = crosscheck[library_col].to_numpy()
+        libraries.append(found)
+    libraries = pandas.concat(libraries).dropna(subset=[PINERY_COL.RootSampleName])
+    return libraries.drop_duplicates(special_cols["library"]).set_index(special_cols["library"])
+
+
+def conflicting_donors(crosscheck, donors):
+    """
+    Donors with two libraries whose fingerprints confidently don't match. A
+    donor split across identities only because its libraries were never
+    compared, or only ambiguously, is not a mismatch.
+    """
+    non_matches = crosscheck[crosscheck[COL.LODScore] < -MATCH_LOD]
+    donor = donors[PINERY_COL.RootSampleName].astype(object)
+    query_donor = non_matches[COL.QueryLibrary].map(donor)
+    match_donor = non_matches[COL.MatchLibrary].map(donor)
+    return set(query_donor[query_donor == match_donor].dropna())
+
+
+def identity_table(index, donors, conflicts):
+    """
+    Each library with its project, donor and inferred identity. A library is a
+    mismatch if its identity includes several donors, or its donor is split
+    across several identities and has libraries that don't match.
+    """
+    df = index.to_frame(special_cols["library"], special_cols["identity"])
+    df = df.join(donors, on=special_cols["library"], how="inner")
+    df = df.astype({PINERY_COL.StudyTitle: object, PINERY_COL.RootSampleName: object})
+
+    by_identity = df.groupby(special_cols["identity"])
+    df[special_cols["identity_libraries"]] = by_identity[special_cols["library"]].transform("size")
+    identity_donors = by_identity[PINERY_COL.RootSampleName].agg(
+        lambda d: ", ".join(sorted(d.unique())))
+    df[special_cols["identity_donors"]] = df[special_cols["identity"]].map(identity_donors)
+    df[special_cols["donor_identities"]] = df.groupby(PINERY_COL.RootSampleName)[
+        special_cols["identity"]].transform("nunique")
+    df[special_cols["mismatch"]] = (
+        (by_identity[PINERY_COL.RootSampleName].transform("nunique") > 1) |
+        ((df[special_cols["donor_identities"]] > 1) &
+         df[PINERY_COL.RootSampleName].isin(conflicts))
+    )
+    return df
+
+
+def dataversion():
+    return df_manipulation.cache.versions(["crosscheckfingerprints"])
+
+
+# Everything the view shows, built from one version of the fingerprint cache
+Identities = namedtuple('Identities', 'version index donors table all_projects')
+
+
+def load_identities():
+    """Build the identity index and tables from the fingerprint cache"""
+    version = dataversion()
+    crosscheck = df_manipulation.get_crosscheckfingerprints()
+    index = IdentityIndex()
+    index.add_libraries(crosscheck[COL.QueryLibrary])
+    index.add_libraries(crosscheck[COL.MatchLibrary])
+    matches = crosscheck[crosscheck[COL.LODScore] > MATCH_LOD]
+    index.add_matches(matches[COL.QueryLibrary], matches[COL.MatchLibrary])
+    donors = library_donors(crosscheck)
+    table = identity_table(index, donors, conflicting_donors(crosscheck, donors))
+    return Identities(
+        version, index, donors, table,
+        df_manipulation.unique_set(table, PINERY_COL.StudyTitle)
+    )
+
+
+IDENTITIES = load_identities()
+# A real lock, as it is released by the thread doing the rebuild
+_reloading = get_original("threading", "Lock")()
+
+
+def _start_thread(target):
+    """
+    Run a function in a real thread. In a gevent worker, threads are greenlets,
+    which would stall every request of the worker while the function runs, so
+    gevent's pool of real threads is used instead.
+    """
+    if is_module_patched("threading"):
+        gevent.get_hub().threadpool.spawn(target)
+    else:
+        threading.Thread(target=target, daemon=True).start()
+
+
+def reload_if_changed():
+    """
+    If the fingerprint cache changed, build the identities again from scratch
+    in the background. Requests are answered from the current identities until
+    the new ones are ready.
+    """
+    if dataversion() == IDENTITIES.version or not _reloading.acquire(blocking=False):
+        return
+    _start_thread(_reload)
+
+
+def _reload():
+    global IDENTITIES
+    try:
+        IDENTITIES = load_identities()
+        logger.info("Rebuilt donor identities for fingerprint cache {0}".format(IDENTITIES.version))
+    except Exception:
+        logger.exception("Failed to rebuild donor identities")
+    finally:
+        _reloading.release()
+
+
+def library_identity(library):
+    """
+    The inferred identity of a library, with the donors of all its libraries.
+    None if the library has not been fingerprinted.
+    """
+    reload_if_changed()
+    identities = IDENTITIES
+    identity = identities.index.identity(library)
+    if identity is None:
+        return None
+    libraries = identities.index.identity_libraries(library)
+    donors = identities.donors.reindex(libraries)
+    return {
+        "library": library,
+        "identity": min(libraries),
+        "donor": None if library not in identities.donors.index else identities.donors.at[library, PINERY_COL.RootSampleName],
+        "libraries": [
+            {
+                "library": lib,
+                "project": None if pandas.isna(row[PINERY_COL.StudyTitle]) else row[PINERY_COL.StudyTitle],
+                "donor": None if pandas.isna(row[PINERY_COL.RootSampleName]) else row[PINERY_COL.RootSampleName],
+            }
+            for lib, row in donors.iterrows()
+        ],
+    }
+
+
+DATA_COLUMN = [
+    PINERY_COL.StudyTitle,
+    special_cols["library"],
+    PINERY_COL.RootSampleName,
+    special_cols["identity"],
+    special_cols["identity_libraries"],
+    special_cols["identity_donors"],
+    special_cols["donor_identities"],
+]
+
+TABLE_COLUMNS = [{"name": i, "id": i} for i in DATA_COLUMN]
+for d in TABLE_COLUMNS:
+    if d["id"] in rename_columns:
+        d["name"] = rename_columns[d["id"]]
+
+def table_data(projects, mismatches_only):
+    df = IDENTITIES.table
+    if mismatches_only:
+        df = df[df[special_cols["mismatch"]]]
+    df = df[df[PINERY_COL.StudyTitle].isin(projects)]
+    return df[DATA_COLUMN].to_dict('records')
+
+
+def layout(query_string):
+    query = sidebar_utils.parse_query(query_string)
+
+    reload_if_changed()
+    identities = IDENTITIES
+    # Built for each page load, so one user's query doesn't change another's page
+    initial = {
+        "projects": query["req_projects"] if len(query["req_projects"]) > 0
+        else identities.all_projects,
+    }
+
+    return core.Loading(fullscreen=True, type="dot", children=[
+        html.Div(className='body', children=[
+            html.Div(className='row flex-container', children=[
+                html.Div(className='sidebar two columns', children=[
+                    html.Button('Update', id=ids['update-button-top'], className="update-button"),
+                    html.Br(),
+                    html.Br(),
+                    sidebar_utils.select_projects(
+                        ids["all-projects"],
+                        ids["projects-list"],
+                        identities.all_projects,
+                        initial["projects"]
+                    ),
+                    core.Checklist(
+                        id=ids["checkbox_show_mismatches"],
+                        options=[
+                            {"label": "Only show mismatches", "value": "mismatch"},
+                        ],
+                        value=["mismatch"]
+                    )
+                ]),
+                html.Div(className="seven columns", children=[
+                    dash_table.DataTable(
+                        id=ids['table'],
+                        columns=TABLE_COLUMNS,
+                        data=table_data(initial["projects"], True),
+                        sort_action="native",
+                        sort_by=[{"column_id": special_cols["identity"], "direction": "asc"}],
+                        export_format="csv",
+                        export_columns="all",
+                        include_headers_on_copy_paste=True,
+                        style_data={
+                            'whiteSpace': 'normal',
+                            'height': 'auto',
+                        },
+                        style_cell={'textAlign': 'left', 'padding-right': '50px'},
+                        style_data_conditional=[
+                            {
+                                "if": {"row_index": "odd"},
+                                "backgroundColor": "rgb(248, 248, 248)"
+                            }
+                        ],
+                        style_header={
+                            "backgroundColor": "rgb(230, 230, 230)",
+                            "fontWeight": "bold"
+                        },
+                    )
+                ])
+            ])
+        ])
+    ])
+
+
+def init_callbacks(dash_app):
+    @dash_app.callback(
+        Output(ids["table"], "data"),
+        [Input(ids["update-button-top"], "n_clicks")],
+        [
+            State(ids["projects-list"], "value"),
+            State(ids["checkbox_show_mismatches"], "value"),
+        ]
+    )
+    def update_pressed(_click, projects, show_mismatches):
+        return table_data(projects, "mismatch" in show_mismatches)
+
+    @dash_app.callback(
+        Output(ids['projects-list'], 'value'),
+        [Input(ids['all-projects'], 'n_clicks')]
+    )
+    def all_projects_requested(click):
+        sidebar_utils.update_only_if_clicked(click)
+        return [x for x in IDENTITIES.all_projects]
@@ -1,14 +1,19 @@
 from dash import dcc as core
 from dash import html
 from dash.dependencies import Input, Output, State
-from dash import dash_table
+from dash import dash_table, no_update
+from dash.exceptions import PreventUpdate
+import dash_bootstrap_components as dbc
 import pinery
 import pandas
+import numpy
+import plotly.graph_objects as go
 import os
 import logging
 
 from ..dash_id import init_ids
 from ..utility import df_manipulation, sidebar_utils
+from ..utility.callback_pool import message_figure, offload, tab_store_id
 from ..utility.df_manipulation import CROSSCHECKFINGERPRINTS_COL as COL
 
 logger = logging.getLogger(__name__)
@@ -23,6 +28,9 @@ title = "Sample Swaps"
 # Set a zone left and right of 0 that where swaps will be ignored
 AMBIGUOUS_ZONE = 20
 
+# Heatmaps of projects with more libraries than this are drawn in blocks of libraries
+HEATMAP_MAX_SIZE = 300
+
 ids = init_ids([
     # Buttons
     'update-button-top',
@@ -31,9 +39,17 @@ ids = init_ids([
     "all-projects",
     "checkbox_show_swaps",
     "projects-list",
+    "view-mode",
+    "heatmap-project",
 
     # Main Table
+    "table-container",
+    "alerts-rejected",
     "table",
+
+    # Heatmap
+    "heatmap-container",
+    "heatmap",
 ])
 
 special_cols = {
@@ -63,30 +79,39 @@ df = df_manipulation.get_crosscheckfingerprints()
 # Libraries that correctly match (the closest library count is 1) don't have ot go through expensive `groupby`
 swap = df[df[COL.ClosestLibrariesCount] != 1].sort_values([COL.QueryLibrary, COL.LODScore], ascending=False)
 
-result = []
-for _, lib in swap.groupby(COL.QueryLibrary, sort=False):
-    # The closest library
-    return_df = lib.head(1).copy()
-    rest = lib.iloc[1:]
-    if len(rest) > 0:
-        return_df[special_cols["expected_library"]] = rest[COL.MatchLibrary].iloc[-1]
-        return_df[special_cols["expected_library_lod"]] = rest[COL.LODScore].iloc[-1]
-        return_df[special_cols["expected_barcode"]] = rest[COL.MatchBarcode].iloc[-1]
-        return_df[special_cols["expected_lane"]] = rest[COL.MatchLane].iloc[-1]
-        return_df[special_cols["expected_run"]] = rest[COL.MatchRun].iloc[-1]
-
-        closest_lib = (
-                rest[COL.MatchLibrary] +
-                " (" +
-                rest[COL.LODScore].round().astype(int).astype(str) +
-                ")"
-        )
-        return_df[special_cols["closest_libraries"]] = ", ".join(closest_lib)
-        return_df[special_cols["significant_lod"]] = any(lib[COL.LODScore].abs() > AMBIGUOUS_ZONE)
-    result.append(return_df)
-
-if len(result) > 0:
-    swap = pandas.concat(result)
+if len(swap) > 0:
+    by_library = swap.groupby(COL.QueryLibrary, sort=False)
+    position = by_library.cumcount()
+    # The closest library is the first row of each library
+    closest = swap[position == 0].copy()
+    # The libraries after the closest one, of libraries that have any
+    rest = swap[position > 0]
+    rest_library = rest[COL.QueryLibrary]
+    has_rest = closest[COL.QueryLibrary].isin(rest_library)
+
+    # The expected library is the last one
+    expected = rest.groupby(rest_library, sort=False).tail(1).set_index(COL.QueryLibrary)
+    closest[special_cols["expected_library"]] = closest[COL.QueryLibrary].map(expected[COL.MatchLibrary])
+    closest[special_cols["expected_library_lod"]] = closest[COL.QueryLibrary].map(expected[COL.LODScore])
+    closest[special_cols["expected_barcode"]] = closest[COL.QueryLibrary].map(expected[COL.MatchBarcode])
+    closest[special_cols["expected_lane"]] = closest[COL.QueryLibrary].map(expected[COL.MatchLane])
+    closest[special_cols["expected_run"]] = closest[COL.QueryLibrary].map(expected[COL.MatchRun])
+
+    closest_lib = (
+            rest[COL.MatchLibrary] +
+            " (" +
+            rest[COL.LODScore].round().astype(int).astype(str) +
+            ")"
+    )
+    closest[special_cols["closest_libraries"]] = closest[COL.QueryLibrary].map(
+        closest_lib.groupby(rest_library, sort=False).agg(", ".join)
+    )
+    significant_lod = (swap[COL.LODScore].abs() > AMBIGUOUS_ZONE).groupby(
+        swap[COL.QueryLibrary], sort=False).any()
+    # Left empty for libraries with a single comparison
+    closest[special_cols["significant_lod"]] = closest[COL.QueryLibrary].map(
+        significant_lod).where(has_rest)
+    swap = closest
 else:
     swap = pandas.DataFrame(columns=df.columns)
 
@@ -95,20 +120,68 @@ non_swaps = df[df[COL.ClosestLibrariesCount] == 1].copy()
 non_swaps[special_cols["closest_libraries"]] = non_swaps[COL.MatchLibrary]
 swap = pandas.concat([swap, non_swaps])
 
-pinery_samples = df_manipulation.get_pinery_samples()
-swap = df_manipulation.df_with_pinery_samples_ius(
-    swap, pinery_samples, [COL.QueryRun, COL.QueryLane, COL.QueryBarcode]
+# Pinery and run columns used for each library of a comparison
+QUERY_PINERY_COLUMNS = [
+    PINERY_COL.SampleName,
+    PINERY_COL.StudyTitle,
+    PINERY_COL.RootSampleName,
+    PINERY_COL.ParentSampleName,
+    PINERY_COL.LibrarySourceTemplateType,
+    PINERY_COL.TissueType,
+    PINERY_COL.TissueOrigin,
+]
+MATCH_PINERY_COLUMNS = [
+    PINERY_COL.RootSampleName,
+    PINERY_COL.ParentSampleName,
+    PINERY_COL.LibrarySourceTemplateType,
+    PINERY_COL.TissueType,
+    PINERY_COL.TissueOrigin,
+]
+EXPECTED_PINERY_COLUMNS = [
+    PINERY_COL.LibrarySourceTemplateType,
+    PINERY_COL.TissueType,
+    PINERY_COL.TissueOrigin,
+]
+RUN_COLUMNS = [RUN_COLS.StartDate]
+
+pinery_samples = df_manipulation.pinery_samples_ius_lookup(
+    df_manipulation.get_pinery_samples(
+        columns=QUERY_PINERY_COLUMNS + MATCH_PINERY_COLUMNS + EXPECTED_PINERY_COLUMNS)
 )
-swap = df_manipulation.df_with_pinery_samples_ius(
-    swap, pinery_samples, [COL.MatchRun, COL.MatchLane, COL.MatchBarcode], "_MATCH"
+run_info = df_manipulation.run_info_lookup()
+swap = swap.reset_index(drop=True)
+query_samples = df_manipulation.lookup_columns(
+    pinery_samples,
+    df_manipulation.join_key(swap, [COL.QueryRun, COL.QueryLane, COL.QueryBarcode]),
+    QUERY_PINERY_COLUMNS
 )
-swap = df_manipulation.df_with_pinery_samples_ius(
-    swap, pinery_samples,
-    [special_cols["expected_run"], special_cols["expected_lane"], special_cols["expected_barcode"]],
-    "_EXPECTED"
+swap = pandas.concat([
+    swap,
+    query_samples,
+    df_manipulation.lookup_columns(
+        pinery_samples,
+        df_manipulation.join_key(swap, [COL.MatchRun, COL.MatchLane, COL.MatchBarcode]),
+        MATCH_PINERY_COLUMNS,
+        "_MATCH"
+    ),
+    df_manipulation.lookup_columns(
+        pinery_samples,
+        df_manipulation.join_key(swap, [
+            special_cols["expected_run"],
+            special_cols["expected_lane"],
+            special_cols["expected_barcode"]
+        ]),
+        EXPECTED_PINERY_COLUMNS,
+        "_EXPECTED"
+    ),
+    df_manipulation.lookup_columns(run_info, swap[COL.QueryRun], RUN_COLUMNS),
+    df_manipulation.lookup_columns(run_info, swap[COL.MatchRun], RUN_COLUMNS, "_MATCH"),
+], axis=1)
+# Drop comparisons with no Pinery data for the query library. This should only
+# happen if data is very old or stale
+swap = df_manipulation.with_compact_dtypes(
+    swap[query_samples[PINERY_COL.SampleName].notna()]
 )
-swap = df_manipulation.df_with_run_info(swap, COL.QueryRun)
-swap = df_manipulation.df_with_run_info(swap, COL.MatchRun, "_MATCH")
 
 # DataFrame that's empty has issues with date column type
 if len(swap) > 0:
@@ -125,11 +198,12 @@ def metadata_to_library(swap_df, library_col, pinery_str):
     return (
             swap[library_col] +
             " (" +
-            swap[PINERY_COL.LibrarySourceTemplateType + pinery_str] +
+            # Pinery attributes are categorical, which don't support string concatenation
+            swap[PINERY_COL.LibrarySourceTemplateType + pinery_str].astype(object) +
             ", " +
-            swap[PINERY_COL.TissueType + pinery_str] +
+            swap[PINERY_COL.TissueType + pinery_str].astype(object) +
             ", " +
-            swap[PINERY_COL.TissueOrigin + pinery_str] +
+            swap[PINERY_COL.TissueOrigin + pinery_str].astype(object) +
             ")"
     )
 
@@ -141,37 +215,60 @@ swap[special_cols["expected_library"]] = metadata_to_library(
 )
 
 
-def exclude_false_positives(swap_df):
+# Library pairs listed in the EXCLUDE_SWAP_LIBS file, and the version of the file they were read from
+_false_positives = {"version": None, "pairs": None}
+# Swaps minus the false positives, and the version of the false positive file they exclude
+_swaps = {"version": None, "swaps": None}
+
+
+def false_positive_pairs():
     """
-    Excludes specific library pair swaps defined in an external file.
+    Reads the specific library pair swaps to exclude, defined in an external
+    file. The file is read again only when it changes.
 
     Current workflow setup prevents this from being done by Shesmu.
 
-    Args:
-        swap_df: The swaps called by Dashi
-
-    Returns: The input table minus the library pairs in the file
+    Returns: The version (path and modification time) of the file and a
+        MultiIndex of the (left, right) library pairs, or `(None, None)` if
+        there is no file
 
     """
     excl_file = os.getenv("EXCLUDE_SWAP_LIBS")
     if excl_file is None:
-        return swap_df
+        return None, None
 
     if not os.path.isfile(excl_file):
         logger.warning("False positive swap file does not exist")
+        return None, None
+
+    version = (excl_file, os.stat(excl_file).st_mtime_ns)
+    if _false_positives["version"] != version:
+        false_pos = pandas.read_csv(excl_file, sep="\t", comment="#")
+        # Only pairs with an issue are false positives
+        false_pos = false_pos[false_pos["JIRA_ISSUE"].notna()]
+        _false_positives["pairs"] = pandas.MultiIndex.from_frame(
+            false_pos[["LEFT_LIBRARY", "RIGHT_LIBRARY"]]
+        )
+        _false_positives["version"] = version
+    return version, _false_positives["pairs"]
+
+
+def exclude_false_positives(swap_df, pairs):
+    """
+    Excludes specific library pair swaps
+
+    Args:
+        swap_df: The swaps called by Dashi
+        pairs: The (left, right) library pairs to exclude, from `false_positive_pairs`
+
+    Returns: The input table minus the library pairs
+
+    """
+    if pairs is None:
         return swap_df
 
-    false_pos = pandas.read_csv(excl_file, sep="\t", comment="#")
-    # Merge will preserve all rows of swap_df. If a row is a false positive, it will
-    # have non-NA values in the false_pol columns
-    matches = swap_df.merge(
-        false_pos,
-        how="left",
-        left_on=[COL.QueryLibrary, COL.MatchLibrary],
-        right_on=["LEFT_LIBRARY", "RIGHT_LIBRARY"],
-    )
-    true_pos = matches["JIRA_ISSUE"].isna()
-    return swap_df[list(true_pos)].copy()
+    libraries = pandas.MultiIndex.from_frame(swap_df[[COL.QueryLibrary, COL.MatchLibrary]])
+    return swap_df[~libraries.isin(pairs)].copy()
 
 
 def filter_for_swaps(df):
@@ -194,10 +291,20 @@ def filter_for_swaps(df):
     single_lib = df[df[special_cols["closest_libraries_count"]] == 0]
     single_lib = single_lib[single_lib[COL.LODScore] > AMBIGUOUS_ZONE]
 
-    swaps = pandas.concat([multi_lib, single_lib])
-    swaps = exclude_false_positives(swaps)
+    return pandas.concat([multi_lib, single_lib])
 
-    return swaps
+
+# The swaps before excluding false positives only change with the data
+swap_candidates = filter_for_swaps(swap)
+
+
+def swaps_only():
+    """The swaps minus false positives, updated only when the false positive file changes"""
+    version, pairs = false_positive_pairs()
+    if _swaps["swaps"] is None or _swaps["version"] != version:
+        _swaps["swaps"] = exclude_false_positives(swap_candidates, pairs)
+        _swaps["version"] = version
+    return _swaps["swaps"]
 
 
 DATA_COLUMN = [
@@ -236,6 +343,115 @@ for d in TABLE_COLUMNS:
         d["name"] = rename_columns[d["id"]]
 
 
+def lod_matrices(comparisons):
+    """
+    Sparse library by library LOD score matrices of each project, with the
+    libraries ordered by donor so each donor's libraries are a block on the
+    diagonal.
+
+    Args:
+        comparisons: All crosscheck fingerprint comparisons
+
+    Returns: {project: {"libraries", "donors", "rows", "cols", "lod"}}, with
+        the library names and donors in matrix order, and the matrix as
+        coordinate (row, column) and LOD arrays
+
+    """
+    query = df_manipulation.lookup_columns(
+        pinery_samples,
+        df_manipulation.join_key(comparisons, [COL.QueryRun, COL.QueryLane, COL.QueryBarcode]),
+        [PINERY_COL.StudyTitle, PINERY_COL.RootSampleName]
+    )
+    match = df_manipulation.lookup_columns(
+        pinery_samples,
+        df_manipulation.join_key(comparisons, [COL.MatchRun, COL.MatchLane, COL.MatchBarcode]),
+        [PINERY_COL.RootSampleName]
+    )
+    pairs = pandas.DataFrame({
+        "project": query[PINERY_COL.StudyTitle].astype(object).to_numpy(),
+        "query": comparisons[COL.QueryLibrary].to_numpy(),
+        "query_donor": query[PINERY_COL.RootSampleName].astype(object).to_numpy(),
+        "match": comparisons[COL.MatchLibrary].to_numpy(),
+        "match_donor": match[PINERY_COL.RootSampleName].astype(object).to_numpy(),
+        "lod": comparisons[COL.LODScore].to_numpy(dtype="float32"),
+    }).dropna(subset=["project"])
+
+    matrices = {}
+    for project, p in pairs.groupby("project", sort=False):
+        libraries = pandas.concat([
+            p[["query", "query_donor"]].set_axis(["library", "donor"], axis=1),
+            p[["match", "match_donor"]].set_axis(["library", "donor"], axis=1),
+        ]).drop_duplicates("library").sort_values(["donor", "library"])
+        codes = pandas.Index(libraries["library"])
+        matrices[project] = {
+            "libraries": libraries["library"].to_numpy(),
+            "donors": libraries["donor"].to_numpy(),
+            "rows": codes.get_indexer(p["query"]).astype("int32"),
+            "cols": codes.get_indexer(p["match"]).astype("int32"),
+            "lod": p["lod"].to_numpy(),
+        }
+    return matrices
+
+
+LOD_MATRICES = lod_matrices(df)
+
+
+def lod_heatmap(project):
+    """
+    Heatmap of a project's LOD matrix. Large projects are drawn in blocks of
+    libraries, showing the score furthest from 0 in each block, so both
+    unexpected matches and unexpected mismatches stand out.
+    """
+    matrix = LOD_MATRICES.get(project)
+    if matrix is None:
+        return go.Figure(layout={"title": "Select a project to show its LOD scores"})
+
+    count = len(matrix["libraries"])
+    block = -(-count // HEATMAP_MAX_SIZE)
+    size = -(-count // block)
+    # Comparisons are drawn both ways, so the matrix is symmetric
+    rows = numpy.concatenate([matrix["rows"], matrix["cols"]]) // block
+    cols = numpy.concatenate([matrix["cols"], matrix["rows"]]) // block
+    lod = numpy.concatenate([matrix["lod"], matrix["lod"]])
+    highest = numpy.full((size, size), numpy.nan, dtype="float32")
+    lowest = numpy.full((size, size), numpy.nan, dtype="float32")
+    numpy.fmax.at(highest, (rows, cols), lod)
+    numpy.fmin.at(lowest, (rows, cols), lod)
+    z = numpy.where(numpy.abs(lowest) > numpy.abs(highest), lowest, highest)
+
+    if block == 1:
+        labels = [
+            "{0} ({1})".format(library, donor)
+            for library, donor in zip(matrix["libraries"], matrix["donors"])
+        ]
+        title = "{0}: LOD scores of {1} libraries".format(project, count)
+    else:
+        labels = [
+            "{0} to {1}".format(
+                matrix["libraries"][i], matrix["libraries"][min(i + block, count) - 1])
+            for i in range(0, count, block)
+        ]
+        title = "{0}: LOD scores of {1} libraries, in blocks of {2}".format(
+            project, count, block)
+
+    return go.Figure(
+        data=[go.Heatmap(
+            z=z,
+            x=labels,
+            y=labels,
+            colorscale="RdBu",
+            zmid=0,
+            hovertemplate="%{y}<br>%{x}<br>LOD: %{z:.0f}<extra></extra>",
+        )],
+        layout={
+            "title": title,
+            "height": 800,
+            "xaxis": {"showticklabels": False},
+            "yaxis": {"showticklabels": False, "autorange": "reversed"},
+        }
+    )
+
+
 # Pair-wise comparison is done within project (for now), so left project is sufficient
 ALL_PROJECTS = df_manipulation.unique_set(swap,PINERY_COL.StudyTitle)
 
@@ -273,14 +489,38 @@ def layout(query_string):
                             {"label": "Only show swaps", "value": "swap"},
                         ],
                         value=["swap"]
-                    )
+                    ),
+                    html.Br(),
+                    html.Label([
+                        "Show:",
+                        core.RadioItems(
+                            id=ids["view-mode"],
+                            options=[
+                                {"label": "Table", "value": "table"},
+                                {"label": "Heatmap", "value": "heatmap"},
+                            ],
+                            value="table"
+                        ),
+                    ]),
+                    html.Label([
+                        "Heatmap Project:",
+                        core.Dropdown(
+                            id=ids["heatmap-project"],
+                            options=[{"label": p, "value": p} for p in sorted(LOD_MATRICES)],
+                            clearable=False,
+                        ),
+                    ]),
+                ]),
+                html.Div(className="seven columns", id=ids["heatmap-container"], style={"display": "none"}, children=[
+                    core.Graph(id=ids["heatmap"], figure=lod_heatmap(None)),
                 ]),
-                html.Div(className="seven columns", children=[
+                html.Div(className="seven columns", id=ids["table-container"], children=[
+                    dbc.Alert(id=ids["alerts-rejected"], color="danger", dismissable=True, is_open=False),
                     dash_table.DataTable(
                         id=ids['table'],
                         columns=TABLE_COLUMNS,
                         hidden_columns=DOWNLOAD_ONLY_COLUMNS,
-                        data=filter_for_swaps(swap).to_dict('records'),
+                        data=swaps_only().to_dict('records'),
                         sort_action="native",
                         sort_by=[{"column_id": "LATEST_RUN", "direction": "desc"}],
                         export_format="csv",
@@ -314,20 +554,58 @@ def layout(query_string):
 
 def init_callbacks(dash_app):
     @dash_app.callback(
-        Output(ids["table"], "data"),
+        [
+            Output(ids["table"], "data"),
+            Output(ids["alerts-rejected"], "children"),
+            Output(ids["alerts-rejected"], "is_open"),
+        ],
         [Input(ids["update-button-top"], "n_clicks")],
         [
             State(ids["projects-list"], "value"),
             State(ids["checkbox_show_swaps"], "value"),
+            State(tab_store_id, "data"),
         ]
     )
-    def update_pressed(_click, projects, show_swap):
+    @offload(
+        ignored_args=1,
+        dataversion=dataversion,
+        rejected=lambda message: [no_update, message, True],
+        selections=["projects"]
+    )
+    def update_pressed(_click, projects, show_swap, tab_id):
         if "swap" in show_swap:
-            df = filter_for_swaps(swap)
+            df = swaps_only()
         else:
             df = swap
         df = df[df[PINERY_COL.StudyTitle].isin(projects)]
-        return df.to_dict('records')
+        return df.to_dict('records'), no_update, False
+
+    @dash_app.callback(
+        Output(ids["heatmap"], "figure"),
+        [
+            Input(ids["view-mode"], "value"),
+            Input(ids["heatmap-project"], "value"),
+        ],
+        [State(tab_store_id, "data")]
+    )
+    @offload(dataversion=dataversion, rejected=message_figure)
+    def update_heatmap(mode, project, tab_id):
+        # Only drawn while it is shown, when it is shown or its project changes
+        if mode != "heatmap":
+            raise PreventUpdate
+        return lod_heatmap(project)
+
+    @dash_app.callback(
+        [
+            Output(ids["table-container"], "style"),
+            Output(ids["heatmap-container"], "style"),
+        ],
+        [Input(ids["view-mode"], "value")]
+    )
+    def view_mode_changed(mode):
+        if mode == "heatmap":
+            return {"display": "none"}, {}
+        return {}, {"display": "none"}
 
     @dash_app.callback(
         Output(ids['projects-list'], 'value'),
@@ -8,6 +8,7 @@ from ..utility.table_builder import table_tabs_single_lane, cutoff_table_data_iu
 from ..utility import df_manipulation as util
 from ..utility import sidebar_utils
 from ..utility import log_utils
+from ..utility.callback_pool import offload, rejected_figure, row_count_cost, tab_store_id
 from gsiqcetl.column import CfMeDipQcColumn, InsertSizeMetricsColumn
 import pinery
 import logging
@@ -77,6 +78,25 @@ special_cols = {
     "Total Clusters (Passed Filter)": "Total Clusters",
 }
 
+# cfMeDIP QC columns used by this view. The rest are dropped as soon as the data is loaded
+cfmedip_columns = [
+    CFMEDIP_COL.ATDropout,
+    CFMEDIP_COL.MethylationBeta,
+    CFMEDIP_COL.NumWindowsWith100Reads,
+    CFMEDIP_COL.NumWindowsWith10Reads,
+    CFMEDIP_COL.NumWindowsWith1Reads,
+    CFMEDIP_COL.NumWindowsWith50Reads,
+    CFMEDIP_COL.ObservedToExpectedEnrichment,
+    CFMEDIP_COL.PercentDuplication,
+    CFMEDIP_COL.PercentPassedFilterAlignedReads,
+    CFMEDIP_COL.PercentageAthaliana,
+    CFMEDIP_COL.Reference,
+    CFMEDIP_COL.RelativeCpGFrequencyEnrichment,
+    CFMEDIP_COL.TotalReads,
+    COMMON_COL.Reference,
+    INSERT_COL.MeanInsertSize,
+]
+
 initial = get_initial_cfmedip_values()
 
 # Set additional initial values for dropdown menus
@@ -95,8 +115,12 @@ cutoff_methylation_beta_label = "Methylation Beta 🚧 NO EFFECT"
 initial["cutoff_methylation_beta"] = 0
 
 def get_cfmedip_data():
-    cfmedip_df = util.get_cfmedip()
-    cfmedip_insert_df = util.get_cfmedip_insert_metrics()
+    pinery_samples = util.get_pinery_samples(columns=util.pinery_view_columns)
+
+    cfmedip_df = util.get_cfmedip(cfmedip_columns)
+    # Drop QC data not in Pinery before any joins or calculations
+    cfmedip_df = util.df_in_pinery_samples_ius(cfmedip_df, pinery_samples, util.cfmedip_ius_columns)
+    cfmedip_insert_df = util.get_cfmedip_insert_metrics(cfmedip_columns)
     cfmedip_df = cfmedip_df.merge(
         cfmedip_insert_df,
         on=[CFMEDIP_COL.Barcodes, CFMEDIP_COL.Lane, CFMEDIP_COL.Run],
@@ -111,8 +135,6 @@ def get_cfmedip_data():
         cfmedip_df[special_cols["Total Clusters (Passed Filter)"]] / 1e6, 3
     )
 
-    pinery_samples = util.get_pinery_samples()
-
     cfmedip_df = util.df_with_pinery_samples_ius(cfmedip_df, pinery_samples, util.cfmedip_ius_columns)
 
     cfmedip_df = util.df_with_run_info(cfmedip_df, PINERY_COL.SequencerRunName)
@@ -200,6 +222,8 @@ SORT_BY = sidebar_utils.default_first_sort + [
      "value": RUN_COLS.CompletionDate},
 ]
 
+cfmedip = add_sort_ranks(cfmedip, SORT_BY)
+
 
 def generate_total_clusters(df, graph_params):
     return SingleLaneSubplot(
@@ -548,8 +572,17 @@ def init_callbacks(dash_app):
             State(ids["date-range"], 'start_date'),
             State(ids["date-range"], 'end_date'),
             State('url', 'search'),
+            State(tab_store_id, 'data'),
         ]
     )
+    @offload(
+        ignored_args=2,
+        dataversion=dataversion,
+        cost=row_count_cost(cfmedip, PINERY_COL.SequencerRunName, 2, len(GRAPHS)),
+        rejected=rejected_figure(12, 2),
+        selections=["runs", "instruments", "projects", "references", "kits",
+                    "institutes", "searchsample", "searchsampleext"]
+    )
     def update_pressed(click,
             click2,
             runs,
@@ -572,7 +605,8 @@ def init_callbacks(dash_app):
             # methylation_beta_cutoff,
             start_date,
             end_date,
-            search_query):
+            search_query,
+            tab_id):
         log_utils.log_filters(locals(), collapsing_functions, logger)
         if searchsample and searchsampleext:
             searchsample += searchsampleext
@@ -721,10 +755,8 @@ def reshape_cfmedip_df(df, runs, instruments, projects, references, kits, instit
         df = df[df[pinery.column.SampleProvenanceColumn.Institute].isin(
             institutes)]
     df = df[df[pinery.column.SampleProvenanceColumn.SequencerRunName].isin(runs_in_range(start_date, end_date))]
-    sort_by = [first_sort, second_sort]
-    df = df.sort_values(by=sort_by)
-    df["SampleNameExtra"] = df[PINERY_COL.SampleName].str.cat(
-        [str(x) for x in range(len(df))], sep=".")
+    df = sort_by_columns(df, first_sort, second_sort)
+    df[SAMPLE_POSITION_COL] = range(len(df))
     df = fill_in_shape_col(df, shape_by, shape_or_colour_values)
     df = fill_in_colour_col(df, colour_by, shape_or_colour_values, searchsample)
     df = fill_in_size_col(df, searchsample)
@@ -9,6 +9,7 @@ from ..utility.table_builder import table_tabs_single_lane, cutoff_table_data_iu
 from ..utility import df_manipulation as util
 from ..utility import sidebar_utils
 from ..utility import log_utils
+from ..utility.callback_pool import offload, rejected_figure, row_count_cost, tab_store_id
 from gsiqcetl.column import RnaSeqQc2Column as RnaColumn
 import pinery
 import logging
@@ -80,6 +81,21 @@ special_cols = {
     "Total Clusters (Passed Filter)": "Total Clusters",
 }
 
+# RNASeqQC columns used by this view. The rest are dropped as soon as the data is loaded
+rnaseqqc_columns = [
+    RNA_COL.AverageReadLength,
+    RNA_COL.InsertMean,
+    RNA_COL.MetricsMedian5PrimeTo3PrimeBias,
+    RNA_COL.MetricsPercentCodingBases,
+    RNA_COL.MetricsPercentCorrectStrandReads,
+    RNA_COL.NonPrimaryReads,
+    RNA_COL.RRnaContaminationInTotal,
+    RNA_COL.RRnaContaminationProperlyPaired,
+    RNA_COL.Reference,
+    RNA_COL.TotalReads,
+    RNA_COL.UniqueReads,
+]
+
 rnaseqqc_curated_columns = [
     PINERY_COL.SampleName,
     PINERY_COL.IUSTag,
@@ -127,7 +143,14 @@ def get_rna_data():
       * Instruments (to allow filtering by instrument model)
       * Runs (needed to join Pinery to Instruments)
     """
-    rna_df = util.get_rnaseqqc2()
+    # Pull in sample metadata from Pinery for only RNA samples
+    pinery_samples = util.get_pinery_samples(
+        library_designs=util.rna_lib_designs,
+        columns=util.pinery_view_columns + [PINERY_COL.UMIs, PINERY_COL.DV200, PINERY_COL.RIN])
+
+    rna_df = util.get_rnaseqqc2(rnaseqqc_columns)
+    # Drop QC data not in Pinery before any joins or calculations
+    rna_df = util.df_in_pinery_samples_ius(rna_df, pinery_samples, util.rnaseqqc2_ius_columns)
     rna_df = util.df_with_fastqc_data(
         rna_df, [RNA_COL.Run, RNA_COL.Lane, RNA_COL.Barcodes]
     )
@@ -143,12 +166,6 @@ def get_rna_data():
         rna_df[RNA_COL.RRnaContaminationProperlyPaired] / rna_df[RNA_COL.RRnaContaminationInTotal] * 100, 3
     )
 
-    # Pull in sample metadata from Pinery
-    pinery_samples = util.get_pinery_samples()
-    # Filter the Pinery samples for only RNA samples.
-    pinery_samples = util.filter_by_library_design(pinery_samples,
-                                                   util.rna_lib_designs)
-
     # Join RNAseqQc and Pinery data
     rna_df = util.df_with_pinery_samples_ius(rna_df, pinery_samples,
                                          util.rnaseqqc2_ius_columns)
@@ -217,6 +234,8 @@ SORT_BY = sidebar_utils.default_first_sort + [
      "value": RUN_COLS.CompletionDate},
 ]
 
+RNA_DF = add_sort_ranks(RNA_DF, SORT_BY)
+
 
 def generate_total_clusters(df, graph_params):
     return SingleLaneSubplot(
@@ -540,8 +559,17 @@ def init_callbacks(dash_app):
             State(ids["date-range"], 'start_date'),
             State(ids["date-range"], 'end_date'),
             State('url', 'search'),
+            State(tab_store_id, 'data'),
         ]
     )
+    @offload(
+        ignored_args=2,
+        dataversion=dataversion,
+        cost=row_count_cost(RNA_DF, PINERY_COL.SequencerRunName, 2, len(GRAPHS)),
+        rejected=rejected_figure(12, 2),
+        selections=["runs", "instruments", "projects", "references", "kits",
+                    "library_designs", "searchsample", "searchsampleext"]
+    )
     def update_pressed(click,
                        click2,
                        runs,
@@ -562,7 +590,8 @@ def init_callbacks(dash_app):
                        rrna_cutoff,
                        start_date,
                        end_date,
-                       search_query):
+                       search_query,
+                       tab_id):
         log_utils.log_filters(locals(), collapsing_functions, logger)
         if searchsample and searchsampleext:
             searchsample += searchsampleext
@@ -8,6 +8,7 @@ from ..utility.table_builder import table_tabs_single_lane, cutoff_table_data_iu
 from ..utility import df_manipulation as util
 from ..utility import sidebar_utils
 from ..utility import log_utils
+from ..utility.callback_pool import offload, rejected_figure, row_count_cost, tab_store_id
 from gsiqcetl.column import BamQc4Column, FastqcColumn
 import pinery
 import logging
@@ -79,6 +80,22 @@ special_cols = {
     "Total Clusters (Passed Filter)": "Total Clusters",
 }
 
+# BamQC columns used by this view. The rest are dropped as soon as the data is loaded
+bamqc_columns = [
+    BAMQC_COL.AverageReadLength,
+    BAMQC_COL.Coverage,
+    BAMQC_COL.CoverageDeduplicated,
+    BAMQC_COL.InsertMean,
+    BAMQC_COL.NonPrimaryReadsMeta,
+    BAMQC_COL.ReadsOnTarget,
+    BAMQC_COL.Reference,
+    BAMQC_COL.TargetFile,
+    BAMQC_COL.TotalInputReadsMeta,
+    BAMQC_COL.TotalReads,
+    BAMQC_COL.TotalTargetSize,
+    BAMQC_COL.UnmappedReadsMeta,
+]
+
 initial = get_initial_single_lane_values()
 
 # Set additional initial values for dropdown menus
@@ -91,7 +108,13 @@ initial["cutoff_insert_mean"] = 150
 
 
 def get_bamqc_data():
-    bamqc_df = util.get_dnaseqqc_and_bamqc4()
+    pinery_samples = util.get_pinery_samples(
+        library_designs=util.ex_lib_designs,
+        columns=util.pinery_view_columns + [PINERY_COL.UMIs])
+
+    bamqc_df = util.get_dnaseqqc_and_bamqc4(bamqc_columns)
+    # Drop QC data not in Pinery before any joins or calculations
+    bamqc_df = util.df_in_pinery_samples_ius(bamqc_df, pinery_samples, util.bamqc4_ius_columns)
     bamqc_df = util.df_with_fastqc_data(bamqc_df, [BAMQC_COL.Run, BAMQC_COL.Lane, BAMQC_COL.Barcodes])
 
     bamqc_df[special_cols["Total Reads (Passed Filter)"]] = round(
@@ -113,14 +136,10 @@ def get_bamqc_data():
                 bamqc_df[BAMQC_COL.AverageReadLength] / 1e9)
         , 3)
 
-    pinery_samples = util.get_pinery_samples()
-
     bamqc_df = util.df_with_pinery_samples_ius(bamqc_df, pinery_samples, util.bamqc4_ius_columns)
 
     bamqc_df = util.df_with_run_info(bamqc_df, PINERY_COL.SequencerRunName)
 
-    bamqc_df = util.filter_by_library_design(bamqc_df, util.ex_lib_designs)
-
     return bamqc_df, util.cache.versions(["bamqc4", "dnaseqqc", "fastqc"])
 
 
@@ -202,6 +221,8 @@ SORT_BY = sidebar_utils.default_first_sort + [
      "value": RUN_COLS.CompletionDate},
 ]
 
+bamqc = add_sort_ranks(bamqc, SORT_BY)
+
 def generate_total_clusters(df, graph_params):
     return SingleLaneSubplot(
         "Total Clusters (Passed Filter)",
@@ -487,8 +508,17 @@ def init_callbacks(dash_app):
             State(ids["date-range"], 'start_date'),
             State(ids["date-range"], 'end_date'),
             State('url', 'search'),
+            State(tab_store_id, 'data'),
         ]
     )
+    @offload(
+        ignored_args=2,
+        dataversion=dataversion,
+        cost=row_count_cost(bamqc, PINERY_COL.SequencerRunName, 2, len(GRAPHS)),
+        rejected=rejected_figure(12, 2),
+        selections=["runs", "instruments", "projects", "references", "kits",
+                    "library_designs", "searchsample", "searchsampleext"]
+    )
     def update_pressed(click,
                        click2,
                        runs,
@@ -508,7 +538,8 @@ def init_callbacks(dash_app):
                        total_clusters_cutoff,
                        start_date,
                        end_date,
-                       search_query):
+                       search_query,
+                       tab_id):
         log_utils.log_filters(locals(), collapsing_functions, logger)
         if searchsample and searchsampleext:
             searchsample += searchsampleext
@@ -9,6 +9,7 @@ from ..utility.table_builder import table_tabs_single_lane, cutoff_table_data_iu
 from ..utility import df_manipulation as util
 from ..utility import sidebar_utils
 from ..utility import log_utils
+from ..utility.callback_pool import offload, rejected_figure, row_count_cost, tab_store_id
 from gsiqcetl.column import FastqcColumn
 import logging
 
@@ -126,6 +127,21 @@ wgs_curated_columns = [
 
 ]
 
+# BamQC columns used by this view. The rest are dropped as soon as the data is loaded
+bamqc_columns = [
+    BAMQC_COL.AverageReadLength,
+    BAMQC_COL.CoverageDeduplicated,
+    BAMQC_COL.InsertMean,
+    BAMQC_COL.InsertMedian,
+    BAMQC_COL.MarkDuplicates_PERCENT_DUPLICATION,
+    BAMQC_COL.NonPrimaryReadsMeta,
+    BAMQC_COL.ReadsOnTarget,
+    BAMQC_COL.Reference,
+    BAMQC_COL.TotalInputReadsMeta,
+    BAMQC_COL.TotalReads,
+    BAMQC_COL.UnmappedReadsMeta,
+]
+
 initial = get_initial_single_lane_values()
 # Set additional initial values for dropdown menus
 initial["second_sort"] = special_cols["Total Clusters (Passed Filter)"]
@@ -148,13 +164,14 @@ def get_wgs_data():
       * Instruments (to allow filtering by instrument model)
       * Runs (needed to join Pinery to Instruments)
     """
-    # Pull in sample metadata from Pinery.
-    pinery_samples = util.get_pinery_samples()
-    # Filter the Pinery samples for WG samples and others which will have BAM files generated.
-    pinery_samples = util.filter_by_library_design(pinery_samples,
-                                                   util.wgs_lib_designs)
-
-    bamqc_df = util.get_dnaseqqc_and_bamqc4()
+    # Pull in sample metadata from Pinery for WG samples and others which will have BAM files generated.
+    pinery_samples = util.get_pinery_samples(
+        library_designs=util.wgs_lib_designs,
+        columns=util.pinery_view_columns + [PINERY_COL.UMIs])
+
+    bamqc_df = util.get_dnaseqqc_and_bamqc4(bamqc_columns)
+    # Drop QC data not in Pinery before any joins or calculations
+    bamqc_df = util.df_in_pinery_samples_ius(bamqc_df, pinery_samples, util.bamqc4_ius_columns)
     bamqc_df = util.df_with_fastqc_data(bamqc_df, [BAMQC_COL.Run, BAMQC_COL.Lane, BAMQC_COL.Barcodes])
 
     bamqc_df[special_cols["Total Reads (Passed Filter)"]] = round(
@@ -244,6 +261,8 @@ SORT_BY = sidebar_utils.default_first_sort + [
      "value": RUN_COLS.CompletionDate},
 ]
 
+WGS_DF = add_sort_ranks(WGS_DF, SORT_BY)
+
 
 def generate_total_clusters(df, graph_params):
     return SingleLaneSubplot(
@@ -552,8 +571,17 @@ def init_callbacks(dash_app):
             State(ids["date-range"], 'start_date'),
             State(ids["date-range"], 'end_date'),
             State('url', 'search'),
+            State(tab_store_id, 'data'),
         ]
     )
+    @offload(
+        ignored_args=2,
+        dataversion=dataversion,
+        cost=row_count_cost(WGS_DF, PINERY_COL.SequencerRunName, 2, len(GRAPHS)),
+        rejected=rejected_figure(12, 2),
+        selections=["runs", "instruments", "projects", "references", "kits",
+                    "library_designs", "searchsample", "searchsampleext"]
+    )
     def update_pressed(click,
                        click2,
                        runs,
@@ -574,7 +602,8 @@ def init_callbacks(dash_app):
                        clusters_per_sample_cutoff,
                        start_date,
                        end_date,
-                       search_query):
+                       search_query,
+                       tab_id):
         log_utils.log_filters(locals(), collapsing_functions, logger)
         if searchsample and searchsampleext:
             searchsample += searchsampleext
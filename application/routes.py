@@ -1,22 +1,91 @@
 from flask import current_app as app
-from flask import render_template, abort
+from flask import render_template, abort, request, send_file
 from version import __version__ as version
 import os
 import json
 import datetime
+import gzip
+import hashlib
+import logging
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from application.dash_application.pages import pages
+from application.run_index import RunIndex, str_timestamp
 import gsiqcetl.api
+import gevent
+from gevent.monkey import is_module_patched
 
 # Dashi doesn't support displaying status data from multiple pages
 # Only the first source is being displayed
 qc_etl_location = os.getenv("GSI_QC_ETL_ROOT_DIRECTORY")
 qc_etl_location = qc_etl_location.split(":")[0]
 
+logger = logging.getLogger(__name__)
+
+# Seconds between refreshes of the QC-ETL cache status shown on /status
+status_refresh_interval = int(os.getenv("STATUS_REFRESH_INTERVAL", "60"))
+
+# Where gzipped copies of the Shesmu input files are kept. If not set, they are
+# always sent uncompressed
+shesmu_gzip_directory = os.getenv("SHESMU_GZIP_DIRECTORY")
+
 # {pagename: Full Text Page Title}
 page_info = {}
 for module in pages:
     page_info[module.page_name] = module.title
 
+
+class StatusFile:
+    """
+    A QC-ETL status file, parsed once and kept in memory. The file is parsed
+    again only when its modification time or size changes.
+    """
+    def __init__(self, name, parse):
+        self.path = os.path.join(qc_etl_location, name)
+        self.parse = parse
+        self.version = None
+        self.value = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        """Returns the parsed file and a version string that changes with the file"""
+        stat = os.stat(self.path)
+        file_version = "{0}-{1}".format(stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if file_version != self.version:
+                with open(self.path, 'r') as f:
+                    self.value = self.parse(json.load(f))
+                self.version = file_version
+            return self.value, self.version
+
+
+def parse_project_status(project_json):
+    return sorted(project_json, key=lambda k: k["project"])
+
+
+run_status = StatusFile('grouped_run_status.json', RunIndex)
+project_status = StatusFile('grouped_project_status.json', parse_project_status)
+
+
+def conditional_page(etag_parts, render, mimetype='text/html'):
+    """
+    Render a page with an ETag built from `etag_parts`, or answer 304 Not
+    Modified without rendering if the browser already has that version
+    """
+    etag = hashlib.sha1(
+        "/".join(str(x) for x in [version] + etag_parts).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(render(), mimetype=mimetype)
+    response.set_etag(etag)
+    # Browsers check with Dashi before reusing their copy
+    response.cache_control.no_cache = True
+    return response
+
+
 ## Use flask's server-side rendering to create a page from templates/index.html
 ## The @app.route decoration tells flask to return this content for both http://<root> and http://<root>/index
 ## Looks at the project_status.json and run_status.json files in the root of the qc-etl output
@@ -27,68 +96,228 @@ for module in pages:
 @app.route('/index')
 def index():
     three_weeks_ago_ts = (datetime.datetime.today() - datetime.timedelta(days=21)).timestamp()
+    three_weeks_ago = str_timestamp(three_weeks_ago_ts)
 
+    # Runs are sorted by completion date, so stop at the first one completed
+    # before the 3-week window
+    run_index, runs_version = run_status.get()
     latest_runs = []
-    with open(qc_etl_location + '/grouped_run_status.json', 'r') as run_status_file:
-        run_json = json.load(run_status_file)
-        for run in run_json:
-            if run["run_completed"] > three_weeks_ago_ts*1000: 
-                # Convert timestamps to string for display
-                run["run_completed"] = str_timestamp(run["run_completed"]/1000)
+    for run in run_index.runs:
+        if run["run_completed"] < three_weeks_ago:
+            break
+        if run["run_completed_ts"] > three_weeks_ago_ts:
+            latest_runs.append(run)
 
-                latest_runs.append(run)
-    latest_runs = sorted(latest_runs, key=lambda k: k["run_completed"], reverse=True)
+    projects, projects_version = project_status.get()
 
-    with open(qc_etl_location + '/grouped_project_status.json', 'r') as project_status_file:
-        project_json = json.load(project_status_file)
-    project_json = sorted(project_json, key=lambda k: k["project"])
-
-    return render_template('index.html',
-    version=version,
-    runs=latest_runs,
-    projects=project_json,
-    page_info=page_info)
+    # Runs only ever leave the window, so its length identifies its content
+    return conditional_page(
+        [runs_version, projects_version, len(latest_runs)],
+        lambda: render_template('index.html',
+            version=version,
+            runs=latest_runs,
+            projects=projects,
+            page_info=page_info)
+    )
 
 
+## The run list is filled in by the page from /api/runs
 @app.route('/runs')
 def run_list():
-    all_runs = []
-    with open(qc_etl_location + '/grouped_run_status.json', 'r') as run_status_file:
-        run_json = json.load(run_status_file)
-        for run in run_json:
-            # Convert timestamps to string for display
-            run["run_completed"] = str_timestamp(run["run_completed"]/1000)
+    return conditional_page(
+        [],
+        lambda: render_template('runs.html',
+            version=version,
+            page_info=page_info)
+    )
+
+
+## A page of runs, most recently completed first. Optional query parameters:
+## `q` (text in the run name, report or processing library names),
+## `start` and `end` (completion date range, YYYY-MM-DD), `page` (from 1) and `per_page`
+@app.route('/api/runs')
+def run_api():
+    text = request.args.get('q', '').strip()
+    start = request.args.get('start') or None
+    end = request.args.get('end') or None
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 100, type=int), 1), 1000)
+    for date in (start, end):
+        if date is not None:
+            try:
+                datetime.datetime.strptime(date, "%Y-%m-%d")
+            except ValueError:
+                abort(400)
+
+    run_index, runs_version = run_status.get()
+
+    def render():
+        selected = run_index.filter(text, start, end)
+        page_runs = [
+            run_index.runs[i]
+            for i in selected[(page - 1) * per_page:page * per_page]
+        ]
+        return json.dumps({
+            "total": len(selected),
+            "page": page,
+            "per_page": per_page,
+            "runs": [{
+                "run": run["run"],
+                "run_completed": run["run_completed"],
+                "pages": run["pages"],
+            } for run in page_runs],
+            # Table rows of the runs, for the All Runs page
+            "html": render_template('run_rows.html', runs=page_runs),
+        })
+
+    return conditional_page(
+        [runs_version, text, start, end, page, per_page],
+        render,
+        mimetype='application/json'
+    )
+
+
+## The inferred identity of a fingerprinted library, with all libraries of that
+## identity and their Pinery donors. Served by the Donor Identities view's index
+@app.route('/api/identity/<library>')
+def library_identity(library):
+    identity_pages = [p for p in pages if p.page_name == "donor_identities"]
+    if len(identity_pages) == 0 or not hasattr(identity_pages[0], "library_identity"):
+        # The view failed to load
+        abort(503)
+    identity = identity_pages[0].library_identity(library)
+    if identity is None:
+        abort(404)
+    return app.response_class(json.dumps(identity), mimetype='application/json')
+
 
-            all_runs.append(run)
-    all_runs = sorted(all_runs, key=lambda k: k["run_completed"], reverse=True)
+def shesmu_gzip_path(cache_name):
+    return os.path.join(shesmu_gzip_directory, cache_name + ".json.gz")
 
-    return render_template('runs.html',
-    version=version,
-    runs=all_runs,
-    page_info=page_info)
+
+def is_shesmu_gzip_current(gzip_path, shesmu_path):
+    """If the gzipped copy was made from the current Shesmu input, whose modification time it is given"""
+    return (
+        os.path.exists(gzip_path) and
+        os.stat(gzip_path).st_mtime == os.stat(shesmu_path).st_mtime
+    )
+
+
+def update_shesmu_gzip(cache_name, shesmu_path):
+    """Write a gzipped copy of a Shesmu input file, unless the current one is up to date"""
+    gzip_path = shesmu_gzip_path(cache_name)
+    if is_shesmu_gzip_current(gzip_path, shesmu_path):
+        return
+    mtime = os.stat(shesmu_path).st_mtime
+    os.makedirs(shesmu_gzip_directory, exist_ok=True)
+    # Replaced in one step, so requests never send a partial copy
+    temp_path = "{0}.{1}.tmp".format(gzip_path, os.getpid())
+    try:
+        with open(shesmu_path, "rb") as source, gzip.open(temp_path, "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.utime(temp_path, (mtime, mtime))
+        os.replace(temp_path, gzip_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def cache_status(qcetlapi, cache):
+    """The error summary, last input date and Shesmu input link of a QC-ETL cache"""
+    error = "Missing error file"
+    lastinputdate = "Cache not enabled"
+    shesmu_input = ""
+
+    error_path = qcetlapi.path_failed_input(cache)
+    if os.path.exists(error_path):
+        with open(error_path, "r") as f:
+            j = json.load(f)
+            if len(j) > 0:
+                error = json.dumps(j, indent=2)
+            else:
+                error = "Ok"
+    cache_path = qcetlapi.path_latest_input(cache)
+    if os.path.exists(cache_path):
+        lastinputdate = datetime.datetime.fromtimestamp(
+            os.stat(cache_path).st_mtime)
+        shesmu_input = "Link"
+        if shesmu_gzip_directory is not None:
+            try:
+                update_shesmu_gzip(cache.name, cache_path)
+            except OSError as e:
+                logger.warning("Could not compress Shesmu input of {0}: {1}".format(cache.name, e))
+    return error, lastinputdate, shesmu_input
+
+
+def io_map(fn, items):
+    """
+    Call a function that reads files on each item concurrently. In a gevent
+    worker, threads are greenlets that would stall the whole worker on each
+    blocking read, so gevent's pool of real threads is used instead.
+    """
+    if is_module_patched("threading"):
+        return list(gevent.get_hub().threadpool.imap(fn, items))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        return list(executor.map(fn, items))
+
+
+class StatusSnapshot:
+    """
+    The status of all QC-ETL caches, refreshed by a background thread every
+    `status_refresh_interval` seconds so /status doesn't wait on the file system
+    """
+    def __init__(self):
+        self.errors = {}
+        self.lastinputdate = {}
+        self.shesmu_input = {}
+        self.taken = None
+        self.lock = threading.Lock()
+        self.thread_pid = None
+
+    def refresh(self):
+        qcetlapi = gsiqcetl.api.QCETLCache(qc_etl_location)
+        formats = list(gsiqcetl.api.formats)
+        # Each cache needs several round trips to the (network) file system
+        statuses = io_map(lambda c: cache_status(qcetlapi, c), formats)
+        taken = time.time()
+        with self.lock:
+            self.errors = {c.name: s[0] for c, s in zip(formats, statuses)}
+            self.lastinputdate = {c.name: s[1] for c, s in zip(formats, statuses)}
+            self.shesmu_input = {c.name: s[2] for c, s in zip(formats, statuses)}
+            self.taken = taken
+
+    def run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh the QC-ETL status")
+            time.sleep(status_refresh_interval)
+
+    def start(self):
+        """Start the refresh thread of this web worker, if it isn't running yet"""
+        with self.lock:
+            # Threads don't survive forking, so each web worker starts its own
+            if self.thread_pid != os.getpid():
+                self.thread_pid = os.getpid()
+                threading.Thread(target=self.run, daemon=True).start()
+
+    def get(self):
+        """
+        The last snapshot, without waiting for a refresh. Empty until the
+        first refresh is done, with `taken` None
+        """
+        self.start()
+        with self.lock:
+            return self.errors, self.lastinputdate, self.shesmu_input, self.taken
+
+
+status_snapshot = StatusSnapshot()
 
 
 @app.route('/status')
 def status_page():
-    qcetlapi = gsiqcetl.api.QCETLCache(qc_etl_location)
-    errors = {c.name: "Missing error file" for c in gsiqcetl.api.formats}
-    lastinputdate = {c.name: "Cache not enabled" for c in gsiqcetl.api.formats}
-    shesmu_input = {c.name: "" for c in gsiqcetl.api.formats}
-
-    for cache in gsiqcetl.api.formats:
-        error_path = qcetlapi.path_failed_input(cache)
-        if os.path.exists(error_path):
-            with open(error_path, "r") as f:
-                j = json.load(f)
-                if len(j) > 0:
-                    errors[cache.name] = json.dumps(j, indent=2)
-                else:
-                    errors[cache.name] = "Ok"
-        cache_path = qcetlapi.path_latest_input(cache)
-        if os.path.exists(cache_path):
-            lastinputdate[cache.name] = datetime.datetime.fromtimestamp(
-                os.stat(cache_path).st_mtime)
-            shesmu_input[cache.name] = "Link"
+    errors, lastinputdate, shesmu_input, taken = status_snapshot.get()
 
     return render_template(
         'status.html',
@@ -97,6 +326,7 @@ def status_page():
         shesmu_input=shesmu_input,
         errors=errors,
         lastinputdate=lastinputdate,
+        snapshot_age=None if taken is None else int(time.time() - taken),
     )
 
 @app.route('/shesmu_input/<cache_name>')
@@ -108,22 +338,28 @@ def shesmu_input(cache_name):
             shesmu_path = qcetlapi.path_latest_input(cache)
             if not os.path.exists(shesmu_path):
                 abort(404)
-            with open(shesmu_path, "r") as f:
-                shesmu_data = f.read()
-            response = app.response_class(
-                response=shesmu_data,
-                status=200,
-                mimetype='application/json'
+            # Send the gzipped copy instead, if the client accepts it and it
+            # was made from the current input. The status refresh writes the
+            # copies, so make sure it is running
+            use_gzip = False
+            if shesmu_gzip_directory is not None:
+                status_snapshot.start()
+                gzip_path = shesmu_gzip_path(cache_name)
+                use_gzip = (
+                    request.accept_encodings["gzip"] > 0 and
+                    is_shesmu_gzip_current(gzip_path, shesmu_path)
+                )
+            # Streamed from the file, with ETag, If-Modified-Since and Range support
+            response = send_file(
+                os.path.abspath(gzip_path if use_gzip else shesmu_path),
+                mimetype='application/json',
+                conditional=True,
+                etag=True,
+                max_age=0,
             )
+            if use_gzip:
+                response.content_encoding = "gzip"
+            response.vary.add("Accept-Encoding")
             return response
 
     abort(404)
-
-def str_timestamp(ts):
-    # To decode: https://docs.python.org/3/library/datetime.html#strftime-strptime-behavior
-    DATE_FORMAT = "%Y-%m-%d"
-
-    return datetime.datetime.fromtimestamp(ts).strftime(DATE_FORMAT)
-
-
-
@@ -0,0 +1,53 @@
+"""
+The runs of the QC-ETL run status file, indexed for the All Runs page and the
+run API. Only uses the standard library, so it can be tested on its own.
+"""
+import bisect
+import datetime
+
+
+def str_timestamp(ts):
+    # To decode: https://docs.python.org/3/library/datetime.html#strftime-strptime-behavior
+    DATE_FORMAT = "%Y-%m-%d"
+
+    return datetime.datetime.fromtimestamp(ts).strftime(DATE_FORMAT)
+
+
+class RunIndex:
+    """
+    Runs sorted by completion date, most recent first, with the columns
+    needed to filter them
+    """
+    def __init__(self, run_json):
+        # Convert timestamps to string for display once, keeping the original
+        # for the 3-week window
+        for run in run_json:
+            run["run_completed_ts"] = run["run_completed"] / 1000
+            run["run_completed"] = str_timestamp(run["run_completed_ts"])
+        self.runs = sorted(run_json, key=lambda k: k["run_completed"], reverse=True)
+        # Oldest first, for bisecting
+        self.ascending_dates = [run["run_completed"] for run in reversed(self.runs)]
+        # Text searches match the run name, reports and processing libraries
+        self.search_text = [
+            "\n".join(
+                [run["run"]] + list(run["pages"]) + [
+                    lib for p in run["pages"].values()
+                    for lib in p.get("processing_libraries", [])
+                ]
+            ).lower()
+            for run in self.runs
+        ]
+
+    def filter(self, text=None, start=None, end=None):
+        """
+        Positions of the runs completed from `start` to `end` (inclusive
+        `YYYY-MM-DD` dates) whose search text contains `text`
+        """
+        count = len(self.runs)
+        # Dates are sorted, so the date range is a slice of the runs
+        first = 0 if end is None else count - bisect.bisect_right(self.ascending_dates, end)
+        last = count if start is None else count - bisect.bisect_left(self.ascending_dates, start)
+        if not text:
+            return range(first, last)
+        text = text.lower()
+        return [i for i in range(first, last) if text in self.search_text[i]]
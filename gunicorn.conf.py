@@ -0,0 +1,40 @@
+# Gunicorn settings, read automatically when gunicorn is started from this directory
+import gc
+import os
+
+from gunicorn.config import Config
+
+# Build the app, including all the Pinery and view DataFrames, once in the master
+# process. Workers are forked from it and share those pages for as long as they
+# are only read, so each extra worker costs little memory
+preload_app = os.getenv("PRELOAD_APP") == "True"
+
+
+def configured_worker_class() -> str:
+    """
+    The worker class gunicorn will use. The command line and GUNICORN_CMD_ARGS
+    override this file, and are only applied after it is read, so parse them
+    the way gunicorn does.
+    """
+    config = Config()
+    parser = config.parser()
+    args = parser.parse_known_args()[0]
+    env_args = parser.parse_known_args(config.get_cmd_args_from_env())[0]
+    return args.worker_class or env_args.worker_class or config.worker_class_str
+
+
+if preload_app and "gevent" in configured_worker_class():
+    # The app is imported before the gevent workers would patch the standard
+    # library, so patch it here first, as they expect. Other worker classes
+    # keep the standard threading and sockets
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        # Move everything loaded so far out of the garbage collector's reach.
+        # Collection in a worker would otherwise write to every object it
+        # inspects, copying the shared pages into that worker
+        gc.collect()
+        gc.freeze()
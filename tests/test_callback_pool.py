@@ -0,0 +1,33 @@
+from application.dash_application.utility.callback_pool import _request_key
+
+
+def test_selection_order_ignored():
+    assert _request_key("view", None, (["r2", "r1"], ("b", "a"), 3), {"projects": ["Q", "P"]},
+                        {0, 1, "projects"}) == \
+        _request_key("view", None, (["r1", "r2"], ("a", "b"), 3), {"projects": ["P", "Q"]},
+                     {0, 1, "projects"})
+
+
+def test_ordered_arguments_kept():
+    # e.g. the names to show, which are drawn in the order given
+    assert _request_key("view", None, (["r1"], ["b", "a"]), {}, {0}) != \
+        _request_key("view", None, (["r1"], ["a", "b"]), {}, {0})
+    assert _request_key("view", None, (), {"show_names": ["b", "a"]}) != \
+        _request_key("view", None, (), {"show_names": ["a", "b"]})
+
+
+def test_arguments_distinguished():
+    key = _request_key("view", None, (["r1"], 3), {}, {0})
+    assert key != _request_key("view", None, (["r1"], 4), {}, {0})
+    assert key != _request_key("other", None, (["r1"], 3), {}, {0})
+    assert key != _request_key("view", None, (["r1", "r2"], 3), {}, {0})
+
+
+def test_dataversion_included():
+    assert _request_key("view", lambda: "v1", (), {}) != \
+        _request_key("view", lambda: "v2", (), {})
+
+
+def test_mixed_selection():
+    assert _request_key("view", None, ([2, "a", None],), {}, {0}) == \
+        _request_key("view", None, ([None, "a", 2],), {}, {0})
@@ -0,0 +1,137 @@
+import numpy
+import pandas
+import pytest
+from pandas import DataFrame
+
+from application.dash_application.utility import df_utils
+
+
+def baseline_aggregate(df, by, columns):
+    """The groupby/agg that aggregate_unique_values replaces"""
+    def join_unique(values):
+        return ", ".join(sorted(
+            str(v) for v in values.unique() if str(v) and str(v) != "nan"))
+
+    if df.empty:
+        return DataFrame(columns=by + columns)
+    return df.groupby(by, sort=True)[columns].agg(join_unique).reset_index()
+
+
+@pytest.mark.parametrize("df", [
+    DataFrame({
+        "run": ["r2", "r1", "r1", "r2", "r1"],
+        "lane": [1, 1, 2, 1, 1],
+        "library": ["b", "a", "c", "a", "a"],
+        "project": ["P", "", "Q", "nan", "P"],
+    }),
+    DataFrame({
+        "run": ["r1"] * 3,
+        "lane": [1] * 3,
+        "library": ["", "", ""],
+        "project": ["nan", "nan", "nan"],
+    }),
+    DataFrame({
+        "run": pandas.Series([], dtype=object),
+        "lane": pandas.Series([], dtype=int),
+        "library": pandas.Series([], dtype=object),
+        "project": pandas.Series([], dtype=object),
+    }),
+])
+def test_aggregate_unique_values(df):
+    result = df_utils.aggregate_unique_values(df, ["run", "lane"], ["library", "project"])
+    expected = baseline_aggregate(df, ["run", "lane"], ["library", "project"])
+    assert result.values.tolist() == expected.values.tolist()
+    assert list(result.columns) == ["run", "lane", "library", "project"]
+
+
+def assert_same_frame(result, expected):
+    pandas.testing.assert_frame_equal(
+        result, expected, check_dtype=False, check_index_type=False)
+
+
+LEFT = DataFrame({
+    "run": ["r1", "r1", "r2", None, "r1", "r3"],
+    "lane": [1, 1, 2, 1, 2, 1],
+    "value": [1.0, 2.0, 3.0, 4.0, numpy.nan, 6.0],
+}, index=[10, 11, 12, 13, 14, 15])
+
+RIGHT = DataFrame({
+    "run": ["r1", "r2", None, "r1"],
+    "lane": [1.0, 2.0, 1.0, 2.0],
+    "value": ["x", "y", "z", "w"],
+    "donor": ["D1", "D2", "D3", "D4"],
+})
+
+
+@pytest.mark.parametrize("left, right", [
+    # Duplicate left keys, a NaN key on both sides and an unmatched key
+    (LEFT, RIGHT),
+    (LEFT.iloc[0:0], RIGHT),
+    (LEFT, RIGHT.iloc[0:0]),
+])
+def test_left_join_on_index(left, right):
+    on = ["run", "lane"]
+    indexed = df_utils.with_join_key_index(right, on, "key")
+    assert df_utils.is_join_key_indexed(indexed, "key")
+
+    result = df_utils.left_join_on_index(
+        left, indexed, df_utils.join_key(left, on), on, on, "_right")
+    expected = left.merge(right, how="left", on=on, suffixes=("", "_right"))
+    if left.empty:
+        # pandas moves the join columns when merging an empty frame
+        assert sorted(result.columns) == sorted(expected.columns)
+        expected = expected[result.columns]
+    assert_same_frame(result, expected)
+
+
+def test_left_join_on_index_different_columns():
+    left = LEFT.rename(columns={"run": "Run", "lane": "Lane"})
+    indexed = df_utils.with_join_key_index(RIGHT, ["run", "lane"], "key")
+    result = df_utils.left_join_on_index(
+        left, indexed, df_utils.join_key(left, ["Run", "Lane"]),
+        ["Run", "Lane"], ["run", "lane"], "_right")
+    expected = left.merge(
+        RIGHT, how="left", left_on=["Run", "Lane"], right_on=["run", "lane"],
+        suffixes=("", "_right"))
+    assert_same_frame(result, expected)
+
+
+def test_join_key_matches_across_dtypes():
+    ints = DataFrame({"run": ["r1", "r2"], "lane": [1, 2]})
+    floats = DataFrame({"run": ["r1", "r2"], "lane": [1.0, 2.0]})
+    categories = floats.astype({"run": "category"})
+    assert df_utils.join_key(ints, ["run", "lane"]).tolist() == \
+        df_utils.join_key(floats, ["run", "lane"]).tolist()
+    assert df_utils.join_key(ints, ["run", "lane"]).tolist() == \
+        df_utils.join_key(categories, ["run", "lane"]).tolist()
+
+
+def test_is_join_key_indexed_needs_unique_keys():
+    duplicated = df_utils.with_join_key_index(pandas.concat([RIGHT, RIGHT]), ["run", "lane"], "key")
+    assert not df_utils.is_join_key_indexed(duplicated, "key")
+    assert not df_utils.is_join_key_indexed(RIGHT, "key")
+
+
+def test_lookup_columns():
+    indexed = RIGHT.set_index("value")
+    keys = ["w", "missing", "x", "w"]
+    result = df_utils.lookup_columns(indexed, keys, ["donor", "run"], "_query")
+    expected = DataFrame({"value": keys}).merge(
+        RIGHT[["value", "donor", "run"]], how="left", on="value"
+    ).drop(columns="value").add_suffix("_query")
+    assert_same_frame(result, expected)
+
+
+@pytest.mark.parametrize("df", [
+    DataFrame({
+        "run": ["r2", "r1", None, "r2", "r3", numpy.nan, "r1"],
+        "value": range(7),
+    }, index=[7, 3, 5, 1, 2, 0, 4]),
+    DataFrame({"run": pandas.Series([], dtype=object), "value": []}),
+])
+def test_partition_rows(df):
+    partitioned, slices = df_utils.partition_by(df, "run")
+    assert sorted(partitioned.index) == sorted(df.index)
+    for run in ["r1", "r2", "r3", "missing"]:
+        pandas.testing.assert_frame_equal(
+            df_utils.partition_rows(partitioned, slices, run), df[df["run"] == run])
@@ -0,0 +1,72 @@
+import random
+
+from application.dash_application.utility.identity_index import IdentityIndex
+
+
+def baseline_identities(libraries, matches):
+    """Connected components of the match graph, by breadth-first search"""
+    neighbours = {lib: set() for lib in libraries}
+    for a, b in matches:
+        neighbours.setdefault(a, set()).add(b)
+        neighbours.setdefault(b, set()).add(a)
+    identities = {}
+    for start in neighbours:
+        if start in identities:
+            continue
+        component = {start}
+        queue = [start]
+        while queue:
+            for lib in neighbours[queue.pop()]:
+                if lib not in component:
+                    component.add(lib)
+                    queue.append(lib)
+        for lib in component:
+            identities[lib] = frozenset(component)
+    return identities
+
+
+def build(libraries, matches):
+    index = IdentityIndex()
+    index.add_libraries(libraries)
+    joined = index.add_matches([a for a, _ in matches], [b for _, b in matches])
+    return index, joined
+
+
+def test_matches_same_as_connected_components():
+    rng = random.Random(0)
+    libraries = ["LIB{0:03}".format(i) for i in range(200)]
+    matches = [(rng.choice(libraries), rng.choice(libraries)) for _ in range(150)]
+    # Libraries only seen in matches are added too
+    matches.append(("NEW1", "LIB000"))
+    index, joined = build(libraries, matches)
+    expected = baseline_identities(libraries, matches)
+
+    assert len(index) == len(expected)
+    assert joined == len(expected) - len(set(expected.values()))
+    for lib, component in expected.items():
+        assert frozenset(index.identity_libraries(lib)) == component
+        assert all(index.identity(other) == index.identity(lib) for other in component)
+
+    frame = index.to_frame("library", "identity")
+    assert dict(zip(frame["library"], frame["identity"])) == {
+        lib: min(component) for lib, component in expected.items()
+    }
+
+
+def test_repeated_and_self_matches_join_nothing():
+    index, joined = build(["a", "b"], [("a", "a"), ("a", "b"), ("b", "a")])
+    assert joined == 1
+    assert sorted(index.identity_libraries("b")) == ["a", "b"]
+
+
+def test_unknown_library():
+    index, _ = build(["a"], [])
+    assert index.identity("b") is None
+    assert index.identity_libraries("b") == []
+    assert len(index) == 1
+
+
+def test_empty():
+    index, joined = build([], [])
+    assert joined == 0
+    assert index.to_frame("library", "identity").empty
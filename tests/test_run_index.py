@@ -0,0 +1,59 @@
+import datetime
+import random
+
+from application.run_index import RunIndex
+
+
+def make_runs(count):
+    rng = random.Random(0)
+    runs = []
+    for i in range(count):
+        completed = datetime.datetime(2023, 1, 1) + datetime.timedelta(days=rng.randrange(60))
+        runs.append({
+            "run": "RUN_{0}".format(i),
+            "run_completed": completed.timestamp() * 1000,
+            "pages": {
+                "call-ready-rna": {"processing_libraries": ["LIB_{0}".format(i % 7)]},
+                "single-lane-wgs": {},
+            } if i % 3 else {},
+        })
+    return runs
+
+
+def baseline_filter(runs, text, start, end):
+    return [
+        i for i, run in enumerate(runs)
+        if (start is None or run["run_completed"] >= start) and
+        (end is None or run["run_completed"] <= end) and
+        (not text or text.lower() in "\n".join(
+            [run["run"]] + list(run["pages"]) + [
+                lib for p in run["pages"].values()
+                for lib in p.get("processing_libraries", [])
+            ]).lower())
+    ]
+
+
+def test_runs_newest_first():
+    index = RunIndex(make_runs(50))
+    dates = [run["run_completed"] for run in index.runs]
+    assert dates == sorted(dates, reverse=True)
+
+
+def test_filter_same_as_scanning_runs():
+    index = RunIndex(make_runs(100))
+    for text in [None, "", "run_1", "lib_3", "SINGLE-LANE", "missing"]:
+        for start, end in [
+            (None, None),
+            ("2023-01-15", None),
+            (None, "2023-02-01"),
+            ("2023-01-10", "2023-01-20"),
+            ("2023-01-20", "2023-01-10"),
+            ("2024-01-01", None),
+        ]:
+            assert list(index.filter(text, start, end)) == \
+                baseline_filter(index.runs, text, start, end), (text, start, end)
+
+
+def test_empty():
+    index = RunIndex([])
+    assert list(index.filter("run", "2023-01-01", "2023-12-31")) == []
@@ -0,0 +1,118 @@
+"""
+Local stand-in for the Pinery web service, for running and benchmarking Dashi's
+Pinery fetches offline.
+
+Record the responses of a real Pinery once:
+
+    python tools/pinery_stub.py record --pinery-url http://pinery-url:8080/pinery-ws-miso \\
+        --directory ./pinery_recording /sequencerruns /instruments /instrumentmodels /projects
+
+then replay them, and point `PINERY_URL` at the stub:
+
+    python tools/pinery_stub.py serve --directory ./pinery_recording --port 8081
+
+Each request path is served from the file of the same path under the recording
+directory, with `.json` appended (the query string is ignored). Responses are
+stored gzipped and sent as-is to clients that accept gzip.
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+def recording_path(directory: str, request_path: str) -> str:
+    """File holding the recorded response of a request path"""
+    path = urlsplit(request_path).path.strip("/")
+    if path == "" or ".." in path.split("/"):
+        raise ValueError("Invalid request path: {0}".format(request_path))
+    return os.path.join(directory, path + ".json.gz")
+
+
+def record(pinery_url: str, directory: str, paths: list):
+    for request_path in paths:
+        target = recording_path(directory, request_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        start = time.perf_counter()
+        request = urllib.request.Request(
+            pinery_url.rstrip("/") + "/" + request_path.lstrip("/"),
+            headers={"Accept": "application/json"}
+        )
+        with urllib.request.urlopen(request) as response:
+            body = response.read()
+        with gzip.open(target, "wb") as f:
+            f.write(body)
+        print("Recorded {0} ({1} bytes) in {2:.2f}s".format(
+            request_path, len(body), time.perf_counter() - start))
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    directory = "."
+    delay = 0.0
+
+    def do_GET(self):
+        try:
+            path = recording_path(self.directory, self.path)
+        except ValueError:
+            self.send_error(400)
+            return
+        if not os.path.isfile(path):
+            self.send_error(404, "No recording for {0}".format(self.path))
+            return
+        with open(path, "rb") as f:
+            body = f.read()
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            encoding = "gzip"
+        else:
+            encoding = None
+            body = gzip.decompress(body)
+        # Simulated server latency
+        time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(directory: str, port: int, delay: float):
+    ReplayHandler.directory = directory
+    ReplayHandler.delay = delay
+    server = ThreadingHTTPServer(("", port), ReplayHandler)
+    print("Replaying {0} on port {1}".format(directory, port))
+    server.serve_forever()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="Record responses from a Pinery")
+    record_parser.add_argument("--pinery-url", default=os.getenv("PINERY_URL"),
+                               help="Pinery web service root. Defaults to PINERY_URL")
+    record_parser.add_argument("--directory", required=True, help="Where to store the recording")
+    record_parser.add_argument("paths", nargs="+", help="Request paths to record")
+
+    serve_parser = subparsers.add_parser("serve", help="Replay recorded responses")
+    serve_parser.add_argument("--directory", required=True, help="Recording to replay")
+    serve_parser.add_argument("--port", type=int, default=8081)
+    serve_parser.add_argument("--delay", type=float, default=0.0,
+                              help="Seconds to wait before each response")
+
+    args = parser.parse_args(argv)
+    if args.command == "record":
+        if args.pinery_url is None:
+            parser.error("--pinery-url or PINERY_URL is required")
+        record(args.pinery_url, args.directory, args.paths)
+    else:
+        serve(args.directory, args.port, args.delay)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])